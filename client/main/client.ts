@@ -183,6 +183,7 @@ function seedFile(absoluteFilePath: string, originalFilePath: string, send_to_el
       hash: hash,
       filename: getFileName(absoluteFilePath),
       magnetLink: torrent.magnetURI,
+      size: torrent.length,
     }
 
     axios
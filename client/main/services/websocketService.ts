@@ -1,4 +1,6 @@
 import { WebSocket } from 'ws';
+import axios from 'axios';
+import fs from 'fs';
 import config from '../config';
 import { ensureValidToken } from './tokenManager';
 import { leechFile } from '../client';
@@ -24,8 +26,9 @@ export async function connectWebSocket() {
 
   console.log('Created connection to websocket');
 
-  socket.addEventListener('open', () => {
+  socket.addEventListener('open', async () => {
     console.log('WebSocket connection established.');
+    await reportFreeSpace(token);
   });
 
   socket.addEventListener('message', async (event) => {
@@ -41,4 +44,20 @@ export async function connectWebSocket() {
   socket.addEventListener('close', () => {
     console.log('WebSocket connection closed.');
   });
-} 
\ No newline at end of file
+} 
+// the server only sends us backups that fit into the free space of the downloads disk
+async function reportFreeSpace(token: string) {
+  try {
+    const stats = await fs.promises.statfs(config.DOWNLOADS_PATH);
+    await axios.put(`${config.DJANGO_SERVER_URL}/api/users/updateFreeSpace/`, {
+      free_space: stats.bavail * stats.bsize,
+    }, {
+      headers: {
+        Authorization: `Bearer ${token}`,
+      },
+      withCredentials: true,
+    });
+  } catch (error) {
+    console.error('Error while reporting free space:', error);
+  }
+}
@@ -47,6 +47,9 @@ const GroupChat: React.FC<GroupChatProps> = ({ groupId, groupName, currentUser }
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
   const [socket, setSocket] = useState<WebSocket | null>(null);
+  // cursor of the oldest loaded message, null when there are no older messages
+  const [olderCursor, setOlderCursor] = useState<string | null>(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const { accessToken } = useAuthStore();
 
@@ -74,7 +77,8 @@ const GroupChat: React.FC<GroupChatProps> = ({ groupId, groupName, currentUser }
     try {
       setLoading(true);
       const response = await apiGet(`/api/messages/group/${groupId}/`);
-      setMessages(response.data);
+      setMessages(response.data.results);
+      setOlderCursor(response.data.previous_cursor);
       setLoading(false);
     } catch (err) {
       console.error('Error fetching messages:', err);
@@ -83,6 +87,21 @@ const GroupChat: React.FC<GroupChatProps> = ({ groupId, groupName, currentUser }
     }
   };
 
+  const fetchOlderMessages = async () => {
+    if (!olderCursor) return;
+
+    try {
+      setLoadingOlder(true);
+      const response = await apiGet(`/api/messages/group/${groupId}/?before=${encodeURIComponent(olderCursor)}`);
+      setMessages(prevMessages => [...response.data.results, ...prevMessages]);
+      setOlderCursor(response.data.previous_cursor);
+    } catch (err) {
+      console.error('Error fetching older messages:', err);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   const setupWebSocket = () => {
     // Close existing socket if any
     if (socket) {
@@ -204,6 +223,13 @@ const GroupChat: React.FC<GroupChatProps> = ({ groupId, groupName, currentUser }
           </Box>
         ) : (
           <List>
+            {olderCursor && (
+              <Box sx={{ display: 'flex', justifyContent: 'center', mb: 1 }}>
+                <Button size="small" onClick={fetchOlderMessages} disabled={loadingOlder}>
+                  {loadingOlder ? 'Loading...' : 'Load earlier messages'}
+                </Button>
+              </Box>
+            )}
             {messages.map((message, index) => {
               const isCurrentUser = currentUser?.id === message.sender_id;
               
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -106,12 +107,65 @@ TEMPLATES = [
 
 # WSGI_APPLICATION = 'peerlink.wsgi.application'
 ASGI_APPLICATION = 'peerlink.asgi.application'
-CHANNEL_LAYERS = {
-    'default': {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
-    }
+
+# Group messages (magnet links, chat messages) go through the channel layer. The in-memory layer only reaches
+# the sockets of its own process, so every deployment running more than one Daphne process has to set
+# CHANNEL_LAYER_BACKEND=redis, which makes all of them share the Redis server(s) of CHANNEL_REDIS_URLS.
+# `python manage.py channel_layer_loadtest` checks that messages reach consumers in other processes.
+CHANNEL_LAYER_BACKEND = os.getenv('CHANNEL_LAYER_BACKEND', 'memory')
+
+CHANNEL_LAYER_CONFIG = {
+    # messages a channel can hold before new ones are dropped, a backup cycle sends
+    # up to REPLICATION_MAX_ASSIGNMENTS_PER_USER magnet links to each user at once
+    "capacity": int(os.getenv('CHANNEL_LAYER_CAPACITY', 1000)),
+    # seconds an undelivered message is kept, and seconds a socket stays in a group without
+    # joining it again (so that the sockets of a process that died are eventually dropped)
+    "expiry": int(os.getenv('CHANNEL_LAYER_EXPIRY', 60)),
+    "group_expiry": int(os.getenv('CHANNEL_LAYER_GROUP_EXPIRY', 86400)),
 }
 
+if CHANNEL_LAYER_BACKEND == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": os.getenv('CHANNEL_REDIS_URLS', "redis://127.0.0.1:6379/0").split(","),
+                "prefix": os.getenv('CHANNEL_LAYER_PREFIX', "peerlink"),
+                **CHANNEL_LAYER_CONFIG,
+            },
+        }
+    }
+elif CHANNEL_LAYER_BACKEND == 'memory':
+    CHANNEL_LAYERS = {
+        'default': {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+            "CONFIG": CHANNEL_LAYER_CONFIG,
+        }
+    }
+else:
+    raise ValueError(f"Unknown CHANNEL_LAYER_BACKEND {CHANNEL_LAYER_BACKEND!r}, expected 'memory' or 'redis'")
+
+# The access index (memberships and per-group files, see peerlink_service/access_index.py) is kept in Django's cache
+# and dropped when it changes. With more than one server process the cache has to be shared too, CACHE_BACKEND=redis,
+# otherwise the other processes keep authorizing a removed member until their copy expires.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv('CACHE_REDIS_URL', "redis://127.0.0.1:6379/1"),
+        }
+    }
+elif CACHE_BACKEND == 'locmem':
+    CACHES = {
+        'default': {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+else:
+    raise ValueError(f"Unknown CACHE_BACKEND {CACHE_BACKEND!r}, expected 'locmem' or 'redis'")
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
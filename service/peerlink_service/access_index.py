@@ -0,0 +1,252 @@
+import uuid
+
+from django.core.cache import cache
+
+from .constants import ACCESS_INDEX_TIMEOUT
+from .models import Access, Group, Membership
+
+
+# The access index keeps, in Django's cache, the set of file hashes every group can see and the set of
+# groups every user belongs to. Search endpoints used to rebuild both from the Access and Membership tables
+# on every request, and the chat checked the membership of a user in a group with a query per socket and request;
+# now they are read from here and dropped by the handlers in signals.py whenever an Access or Membership row changes.
+
+def _group_files_key(group_id):
+    return f"access_group_files_{group_id}"
+
+
+def _user_groups_key(user_id):
+    return f"access_user_groups_{user_id}"
+
+
+def _group_name_key(group_id):
+    return f"access_group_name_{group_id}"
+
+
+def get_group_file_hashes(group_ids):
+    """
+    returns {group_id: frozenset(file_hash)} for the given groups,
+    loading the groups that are not cached yet with a single query
+    """
+    group_ids = [str(group_id) for group_id in group_ids]
+    keys = {_group_files_key(group_id): group_id for group_id in group_ids}
+
+    cached = cache.get_many(keys.keys())
+    result = {keys[key]: hashes for key, hashes in cached.items()}
+
+    missing = [group_id for group_id in group_ids if group_id not in result]
+    if missing:
+        loaded = {group_id: set() for group_id in missing}
+        for group_id, file_hash in Access.objects.filter(group__in=missing).values_list("group_id", "file_hash"):
+            loaded[str(group_id)].add(file_hash)
+
+        loaded = {group_id: frozenset(hashes) for group_id, hashes in loaded.items()}
+        cache.set_many({_group_files_key(group_id): hashes for group_id, hashes in loaded.items()}, ACCESS_INDEX_TIMEOUT)
+        result.update(loaded)
+
+    return result
+
+
+async def aget_group_file_hashes(group_ids):
+    group_ids = [str(group_id) for group_id in group_ids]
+    keys = {_group_files_key(group_id): group_id for group_id in group_ids}
+
+    cached = await cache.aget_many(keys.keys())
+    result = {keys[key]: hashes for key, hashes in cached.items()}
+
+    missing = [group_id for group_id in group_ids if group_id not in result]
+    if missing:
+        loaded = {group_id: set() for group_id in missing}
+        async for group_id, file_hash in Access.objects.filter(group__in=missing).values_list("group_id", "file_hash"):
+            loaded[str(group_id)].add(file_hash)
+
+        loaded = {group_id: frozenset(hashes) for group_id, hashes in loaded.items()}
+        await cache.aset_many({_group_files_key(group_id): hashes for group_id, hashes in loaded.items()}, ACCESS_INDEX_TIMEOUT)
+        result.update(loaded)
+
+    return result
+
+
+def get_allowed_file_hashes(group_ids):
+    """returns the union of the file hashes the given groups have access to"""
+    hashes = get_group_file_hashes(group_ids).values()
+    return frozenset().union(*hashes)
+
+
+async def aget_allowed_file_hashes(group_ids):
+    hashes = (await aget_group_file_hashes(group_ids)).values()
+    return frozenset().union(*hashes)
+
+
+def get_user_group_ids(user):
+    """returns the ids (as strings) of the groups `user` is a member of"""
+    key = _user_groups_key(user.id)
+    group_ids = cache.get(key)
+
+    if group_ids is None:
+        group_ids = [str(group_id) for group_id in Membership.objects.filter(user_id=user.id).values_list("group_id", flat=True)]
+        cache.set(key, group_ids, ACCESS_INDEX_TIMEOUT)
+
+    return group_ids
+
+
+async def aget_user_group_ids(user):
+    key = _user_groups_key(user.id)
+    group_ids = await cache.aget(key)
+
+    if group_ids is None:
+        group_ids = [str(group_id) async for group_id in Membership.objects.filter(user_id=user.id).values_list("group_id", flat=True)]
+        await cache.aset(key, group_ids, ACCESS_INDEX_TIMEOUT)
+
+    return group_ids
+
+
+def _normalize_group_id(group_id):
+    try:
+        return str(uuid.UUID(str(group_id)))
+    except ValueError:
+        return None
+
+
+def is_member(user, group_id):
+    """whether `user` is a member of the group `group_id`, answered from the cached groups of the user"""
+    group_id = _normalize_group_id(group_id)
+    return group_id is not None and group_id in get_user_group_ids(user)
+
+
+async def ais_member(user, group_id):
+    group_id = _normalize_group_id(group_id)
+    return group_id is not None and group_id in await aget_user_group_ids(user)
+
+
+def resolve_group_ids(user, group_id=""):
+    """
+    returns the group scope of a search: the requested group if `group_id` is given,
+    otherwise every group of the user
+    """
+    if group_id != "":
+        return [str(uuid.UUID(group_id))]
+    return get_user_group_ids(user)
+
+
+async def aresolve_group_ids(user, group_id=""):
+    if group_id != "":
+        return [str(uuid.UUID(group_id))]
+    return await aget_user_group_ids(user)
+
+
+def get_file_group_ids(file_hash):
+    """returns the ids (as strings) of the groups that have access to `file_hash`"""
+    group_ids = Access.objects.filter(file_hash=file_hash).order_by("id").values_list("group_id", flat=True)
+    return [str(group_id) for group_id in group_ids]
+
+
+def get_group_ids_by_file_hashes(file_hashes):
+    """returns {file_hash: [group_id]} for the given files, with a single query"""
+    group_ids_by_hash = {}
+    for file_hash, group_id in Access.objects.filter(file_hash__in=file_hashes).order_by("id").values_list("file_hash", "group_id"):
+        group_ids_by_hash.setdefault(file_hash, []).append(str(group_id))
+    return group_ids_by_hash
+
+
+def get_group_ids_by_file_hash():
+    """returns {file_hash: [group_id]} for every file in the Access table"""
+    group_ids_by_hash = {}
+    for file_hash, group_id in Access.objects.order_by("id").values_list("file_hash", "group_id").iterator():
+        group_ids_by_hash.setdefault(file_hash, []).append(str(group_id))
+    return group_ids_by_hash
+
+
+def revoke_file_access(file_hash):
+    """removes the file from every group, e.g. when a report about it is approved"""
+    return Access.objects.filter(file_hash=file_hash).delete()
+
+
+def get_group_names(group_ids):
+    """returns {group_id: name} for the given groups, loading the groups that are not cached yet with a single query"""
+    group_ids = {str(group_id) for group_id in group_ids}
+    keys = {_group_name_key(group_id): group_id for group_id in group_ids}
+
+    cached = cache.get_many(keys.keys())
+    result = {keys[key]: name for key, name in cached.items()}
+
+    missing = group_ids - result.keys()
+    if missing:
+        loaded = {str(group_id): name for group_id, name in Group.objects.filter(id__in=missing).values_list("id", "name")}
+        cache.set_many({_group_name_key(group_id): name for group_id, name in loaded.items()}, ACCESS_INDEX_TIMEOUT)
+        result.update(loaded)
+
+    return result
+
+
+async def aget_group_names(group_ids):
+    group_ids = {str(group_id) for group_id in group_ids}
+    keys = {_group_name_key(group_id): group_id for group_id in group_ids}
+
+    cached = await cache.aget_many(keys.keys())
+    result = {keys[key]: name for key, name in cached.items()}
+
+    missing = group_ids - result.keys()
+    if missing:
+        loaded = {str(group_id): name async for group_id, name in Group.objects.filter(id__in=missing).values_list("id", "name")}
+        await cache.aset_many({_group_name_key(group_id): name for group_id, name in loaded.items()}, ACCESS_INDEX_TIMEOUT)
+        result.update(loaded)
+
+    return result
+
+
+def _first_group_ids(files):
+    return {file["hash"]: file["group_ids"][0] for file in files if file.get("group_ids")}
+
+
+def _set_group_names(files, first_group_ids, names):
+    for file in files:
+        file["group"] = names.get(first_group_ids.get(file["hash"]))
+    return files
+
+
+def attach_group_names(files):
+    """
+    sets "group" of every file hit to the name of the first group that got access to it.
+    the group ids come from the documents themselves, only the files indexed without
+    `group_ids` are looked up in the Access table, all of them in a single query.
+    """
+    first_group_ids = _first_group_ids(files)
+
+    missing = {file["hash"] for file in files if file["hash"] not in first_group_ids}
+    if missing:
+        for file_hash, group_id in Access.objects.filter(file_hash__in=missing).order_by("id").values_list("file_hash", "group_id"):
+            first_group_ids.setdefault(file_hash, str(group_id))
+
+    names = get_group_names(first_group_ids.values())
+    return _set_group_names(files, first_group_ids, names)
+
+
+async def aattach_group_names(files, known_names=None):
+    """
+    async `attach_group_names`, `known_names` ({group_id: name}, e.g. the names of the searched groups
+    fetched while Elasticsearch was running the query) are not looked up again
+    """
+    known_names = known_names or {}
+    first_group_ids = _first_group_ids(files)
+
+    missing = {file["hash"] for file in files if file["hash"] not in first_group_ids}
+    if missing:
+        async for file_hash, group_id in Access.objects.filter(file_hash__in=missing).order_by("id").values_list("file_hash", "group_id"):
+            first_group_ids.setdefault(file_hash, str(group_id))
+
+    names = dict(known_names)
+    names.update(await aget_group_names(set(first_group_ids.values()) - names.keys()))
+    return _set_group_names(files, first_group_ids, names)
+
+
+def invalidate_group(group_id):
+    cache.delete(_group_files_key(group_id))
+
+
+def invalidate_user(user_id):
+    cache.delete(_user_groups_key(user_id))
+
+
+def invalidate_group_name(group_id):
+    cache.delete(_group_name_key(group_id))
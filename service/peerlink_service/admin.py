@@ -3,6 +3,7 @@ from django.utils.html import format_html
 from django.urls import reverse
 from django.db.models import Count
 from .models import User, Report, Shared
+from .access_index import revoke_file_access
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -59,6 +60,7 @@ class ReportAdmin(admin.ModelAdmin):
     def approve_reports(self, request, queryset):
         queryset.update(status='APPROVED')
         for report in queryset:
+            revoke_file_access(report.file.file_hash)
             report.file.delete()
     approve_reports.short_description = 'Approve selected reports and delete files'
     
@@ -90,6 +92,7 @@ class ReportAdmin(admin.ModelAdmin):
         report = Report.objects.get(id=report_id)
         report.status = 'APPROVED'
         report.save()
+        revoke_file_access(report.file.file_hash)
         report.file.delete()
         self.message_user(request, f'Report #{report_id} approved and file deleted.')
         return self.response_post_save_change(request, report)
@@ -6,5 +6,6 @@ class PeerlinkServiceConfig(AppConfig):
     name = 'peerlink_service'
 
     def ready(self):
+        from . import signals  # noqa: F401 (registers the signal handlers)
         from .scheduler import start
         start()
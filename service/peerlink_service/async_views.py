@@ -0,0 +1,42 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import JsonResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+
+class AsyncAPIView(APIView):
+    """
+    Base of the views whose handlers are coroutines, they run on Daphne's event loop instead of
+    taking a thread of the sync pool for the whole request. DRF cannot dispatch to async handlers, so
+    this does the little of DRF they rely on: the JWT authentication of `request.user` and JSON bodies.
+    Handlers return JsonResponse. It is still an APIView, so drf_yasg documents it like the other views.
+    """
+    # same meaning as permission_classes = [IsAuthenticated]
+    authentication_required = False
+
+    # the Django versions, DRF's raise exceptions or return Responses that only its own dispatch can handle
+    http_method_not_allowed = View.http_method_not_allowed
+    options = View.options
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args, self.kwargs, self.request = args, kwargs, request
+        try:
+            authenticated = await sync_to_async(JWTAuthentication().authenticate)(request)
+        except AuthenticationFailed as e:
+            return JsonResponse({"detail": str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+
+        request.user = authenticated[0] if authenticated else AnonymousUser()
+        if self.authentication_required and not request.user.is_authenticated:
+            return JsonResponse({"detail": "Authentication credentials were not provided."}, status=status.HTTP_401_UNAUTHORIZED)
+
+        return await View.dispatch(self, request, *args, **kwargs)
+
+    @staticmethod
+    def json_body(request):
+        return json.loads(request.body or b"{}")
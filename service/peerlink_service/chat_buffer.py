@@ -0,0 +1,196 @@
+import atexit
+import json
+import os
+import socket
+import threading
+from itertools import count
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, close_old_connections
+from django.utils.dateparse import parse_datetime
+
+from .constants import CHAT_FLUSH_BATCH_SIZE, CHAT_FLUSH_INTERVAL, CHAT_JOURNAL_DIR
+from .models import Group, Message, User
+
+
+# Chat messages are broadcast as soon as they are received, with their id and timestamp assigned by the server,
+# and written to the database afterwards by a background thread, CHAT_FLUSH_BATCH_SIZE messages per INSERT at most,
+# CHAT_FLUSH_INTERVAL seconds after they were received at the latest.
+# Before being broadcast every message is appended to a journal segment of this process, which is deleted once
+# all its messages are stored. The buffer is flushed when the process exits, and the segments a process left
+# behind when it was killed are stored by `python manage.py replay_chat_messages`. Messages have their UUID
+# from the start, so storing one twice (e.g. replaying a segment the process stored right before dying) is harmless.
+
+def _journal_line(message):
+    return json.dumps({
+        "id": str(message.id),
+        "group_id": str(message.group_id),
+        "sender_id": str(message.sender_id),
+        "content": message.content,
+        "timestamp": message.timestamp.isoformat(),
+    }) + "\n"
+
+
+def _journal_message(line):
+    data = json.loads(line)
+    return Message(
+        id=data["id"],
+        group_id=data["group_id"],
+        sender_id=data["sender_id"],
+        content=data["content"],
+        timestamp=parse_datetime(data["timestamp"]),
+    )
+
+
+def store_messages(messages):
+    """stores `messages`, leaving out the ones already stored and the ones whose group or sender was deleted meanwhile"""
+    try:
+        Message.objects.bulk_create(messages, batch_size=CHAT_FLUSH_BATCH_SIZE, ignore_conflicts=True)
+    except IntegrityError:
+        group_ids = {str(id) for id in Group.objects.filter(id__in={message.group_id for message in messages}).values_list("id", flat=True)}
+        sender_ids = {str(id) for id in User.objects.filter(id__in={message.sender_id for message in messages}).values_list("id", flat=True)}
+        messages = [message for message in messages if str(message.group_id) in group_ids and str(message.sender_id) in sender_ids]
+        Message.objects.bulk_create(messages, batch_size=CHAT_FLUSH_BATCH_SIZE, ignore_conflicts=True)
+
+
+def _segment_owner(path):
+    """returns the (host, pid) of the process that wrote the journal segment `path`"""
+    host, pid, _ = os.path.basename(path).rsplit("-", 2)
+    return host, int(pid)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def orphan_segments(journal_dir=CHAT_JOURNAL_DIR):
+    """journal segments of processes that are no longer running on this host (or ran on another host)"""
+    if not os.path.isdir(journal_dir):
+        return []
+
+    hostname = socket.gethostname()
+    segments = []
+    for name in sorted(os.listdir(journal_dir)):
+        if not name.endswith(".jsonl"):
+            continue
+        path = os.path.join(journal_dir, name)
+        host, pid = _segment_owner(path)
+        if host == hostname and _is_running(pid):
+            continue
+        segments.append(path)
+    return segments
+
+
+def replay_segment(path):
+    """stores the messages of the journal segment `path` and deletes it, returns the number of messages in it"""
+    with open(path) as segment:
+        # the last line is cut short if the process died while writing it
+        messages = []
+        for line in segment:
+            try:
+                messages.append(_journal_message(line))
+            except (ValueError, KeyError):
+                pass
+
+    if messages:
+        store_messages(messages)
+    os.remove(path)
+    return len(messages)
+
+
+class ChatMessageBuffer:
+    """
+    Collects the chat messages received by this process and stores them in batches on a background thread,
+    started by the first message.
+    """
+
+    def __init__(self, batch_size=CHAT_FLUSH_BATCH_SIZE, interval=CHAT_FLUSH_INTERVAL, journal_dir=CHAT_JOURNAL_DIR):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.journal_dir = journal_dir
+        self.segment_numbers = count()
+        self.lock = threading.Lock()
+        # only one flush at a time, so that the batches are stored in the order they were received
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        # the messages not given to a flush yet, and the journal segment they are written to
+        self.pending = []
+        self.segment = None
+        # [(segment path, messages)] handed to a flush that failed, retried by the next one
+        self.unstored = []
+
+    def _open_segment(self):
+        os.makedirs(self.journal_dir, exist_ok=True)
+        name = f"{socket.gethostname()}-{os.getpid()}-{next(self.segment_numbers)}.jsonl"
+        return open(os.path.join(self.journal_dir, name), "a")
+
+    def add(self, message):
+        """journals `message`, an unsaved Message with its id and timestamp set, and queues it for storing"""
+        line = _journal_line(message)
+        with self.lock:
+            if self.segment is None:
+                self.segment = self._open_segment()
+            self.segment.write(line)
+            # survives the process crashing, not the machine
+            self.segment.flush()
+            self.pending.append(message)
+            full = len(self.pending) >= self.batch_size
+
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="chat-message-buffer", daemon=True)
+                self.thread.start()
+
+        if full:
+            self.wakeup.set()
+
+    async def aadd(self, message):
+        """`add` for the event loop: the journal is written and flushed on a thread of the executor, not on the loop"""
+        await sync_to_async(self.add, thread_sensitive=False)(message)
+
+    def flush(self):
+        """stores every message added so far, raises if the database cannot be reached (they are retried by the next flush)"""
+        with self.flush_lock:
+            with self.lock:
+                if self.pending:
+                    self.segment.close()
+                    self.unstored.append((self.segment.name, self.pending))
+                    self.segment, self.pending = None, []
+
+            while self.unstored:
+                path, messages = self.unstored[0]
+                store_messages(messages)
+                self.unstored.pop(0)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # replayed meanwhile
+                    pass
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+            try:
+                self.flush()
+            except Exception as e:
+                print("Storing chat messages failed:", e)
+            finally:
+                close_old_connections()
+
+    def close(self):
+        try:
+            self.flush()
+        except Exception as e:
+            print("Storing chat messages failed, replay them with `manage.py replay_chat_messages`:", e)
+
+
+chat_message_buffer = ChatMessageBuffer()
+atexit.register(chat_message_buffer.close)
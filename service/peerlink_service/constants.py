@@ -1,6 +1,79 @@
 import os
 
-ELASTICSEARCH_URL = "http://144.122.71.171:8083"
+ELASTICSEARCH_URL = os.getenv('ELASTICSEARCH_URL', "http://144.122.71.171:8083")
 FILES_INDEX = "files-index"
+FILES_INDEX_TEMPLATE = "files-index-template"
 
-ELASTICSEARCH_MAX_RESULTS = int(os.getenv('ELASTICSEARCH_MAX_RESULTS', 1000))
\ No newline at end of file
+ELASTICSEARCH_MAX_RESULTS = int(os.getenv('ELASTICSEARCH_MAX_RESULTS', 1000))
+
+# connection pool and retry behaviour of the Elasticsearch clients
+ELASTICSEARCH_CONNECTIONS_PER_NODE = int(os.getenv('ELASTICSEARCH_CONNECTIONS_PER_NODE', 25))
+ELASTICSEARCH_REQUEST_TIMEOUT = float(os.getenv('ELASTICSEARCH_REQUEST_TIMEOUT', 10))
+ELASTICSEARCH_MAX_RETRIES = int(os.getenv('ELASTICSEARCH_MAX_RETRIES', 3))
+
+# seconds the access index keeps per-group file hashes and per-user group ids cached
+ACCESS_INDEX_TIMEOUT = int(os.getenv('ACCESS_INDEX_TIMEOUT', 300))
+
+# page sizes of the cursor paginated search endpoint
+SEARCH_DEFAULT_PAGE_SIZE = int(os.getenv('SEARCH_DEFAULT_PAGE_SIZE', 50))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv('SEARCH_MAX_PAGE_SIZE', 200))
+
+# entries and seconds to live of the per-process search result cache, see search_cache.py
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 1000))
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 60))
+
+# number of values the search suggestions endpoint returns
+SEARCH_SUGGESTIONS_SIZE = int(os.getenv('SEARCH_SUGGESTIONS_SIZE', 5))
+
+# most files whose rating summaries can be asked for, and most ratings that can be submitted, in one request
+RATING_SUMMARY_MAX_FILES = int(os.getenv('RATING_SUMMARY_MAX_FILES', 500))
+RATING_BATCH_MAX_SIZE = int(os.getenv('RATING_BATCH_MAX_SIZE', 500))
+
+# number of buckets of every facet (groups, extensions, owners) returned with faceted searches
+SEARCH_FACET_SIZE = int(os.getenv('SEARCH_FACET_SIZE', 10))
+
+# documents per Elasticsearch bulk request
+BULK_INDEX_CHUNK_SIZE = int(os.getenv('BULK_INDEX_CHUNK_SIZE', 500))
+
+# documents queued by /index-metadata/ within INDEX_BATCH_WINDOW seconds of each other are
+# indexed together, in batches of at most INDEX_BATCH_SIZE documents
+INDEX_BATCH_WINDOW = float(os.getenv('INDEX_BATCH_WINDOW', 0.05))
+INDEX_BATCH_SIZE = int(os.getenv('INDEX_BATCH_SIZE', 200))
+
+# a document that could not be indexed is retried after INDEX_RETRY_BASE_DELAY seconds, doubling on every
+# attempt up to INDEX_RETRY_MAX_DELAY, and given up after INDEX_MAX_ATTEMPTS attempts
+INDEX_MAX_ATTEMPTS = int(os.getenv('INDEX_MAX_ATTEMPTS', 10))
+INDEX_RETRY_BASE_DELAY = float(os.getenv('INDEX_RETRY_BASE_DELAY', 5))
+INDEX_RETRY_MAX_DELAY = float(os.getenv('INDEX_RETRY_MAX_DELAY', 600))
+
+# seconds between two scheduled checks of the outbox for retries and documents left over from a restart
+INDEX_POLL_INTERVAL = int(os.getenv('INDEX_POLL_INTERVAL', 30))
+
+# number of most similar files kept per file by the recommendation job, and minutes between two runs of it
+RECOMMENDATION_NEIGHBOURS = int(os.getenv('RECOMMENDATION_NEIGHBOURS', 20))
+RECOMMENDATION_REFRESH_MINUTES = int(os.getenv('RECOMMENDATION_REFRESH_MINUTES', 60))
+
+# most under-replicated files, the ones missing the most sharers first, that a backup cycle sends out
+REPLICATION_MAX_FILES_PER_CYCLE = int(os.getenv('REPLICATION_MAX_FILES_PER_CYCLE', 500))
+# most backup magnet links a user gets per cycle, and minutes after which an unfinished backup is given up and sent again
+REPLICATION_MAX_ASSIGNMENTS_PER_USER = int(os.getenv('REPLICATION_MAX_ASSIGNMENTS_PER_USER', 5))
+REPLICATION_ASSIGNMENT_TIMEOUT = int(os.getenv('REPLICATION_ASSIGNMENT_TIMEOUT', 30))
+
+# a websocket connection counts as online for PRESENCE_TTL seconds after its process last reported it,
+# which every process does for its connections every PRESENCE_HEARTBEAT_INTERVAL seconds
+PRESENCE_TTL = int(os.getenv('PRESENCE_TTL', 90))
+PRESENCE_HEARTBEAT_INTERVAL = int(os.getenv('PRESENCE_HEARTBEAT_INTERVAL', 30))
+
+# chat messages are stored in batches of at most CHAT_FLUSH_BATCH_SIZE, at most CHAT_FLUSH_INTERVAL seconds after they
+# were broadcast, and journaled until then to files in CHAT_JOURNAL_DIR, see chat_buffer.py
+CHAT_FLUSH_BATCH_SIZE = int(os.getenv('CHAT_FLUSH_BATCH_SIZE', 100))
+CHAT_FLUSH_INTERVAL = float(os.getenv('CHAT_FLUSH_INTERVAL', 0.5))
+CHAT_JOURNAL_DIR = os.getenv('CHAT_JOURNAL_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chat-journal'))
+
+# messages per page of a group's chat history, when not asked otherwise and at most
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv('CHAT_HISTORY_PAGE_SIZE', 50))
+CHAT_HISTORY_MAX_PAGE_SIZE = int(os.getenv('CHAT_HISTORY_MAX_PAGE_SIZE', 200))
+
+# the `next_cursor` of a chat history page does not go past the messages received less than CHAT_HISTORY_SETTLE_SECONDS
+# ago, which may still be waiting to be stored while newer ones already are (see CHAT_FLUSH_INTERVAL)
+CHAT_HISTORY_SETTLE_SECONDS = float(os.getenv('CHAT_HISTORY_SETTLE_SECONDS', 5))
@@ -1,112 +1,94 @@
-import json
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
 
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
-
-from .models import Group, Message
+from . import presence
+from .access_index import ais_member
+from .chat_buffer import chat_message_buffer
+from .models import Message
 from .serializers import MessageSerializer
 
 
-class MagnetLinkConsumer(WebsocketConsumer):
-    active_users = set()
+# Both consumers run on the event loop: channel layer calls are awaited directly and the database is only
+# reached through the async ORM or database_sync_to_async. Chat messages are stored by chat_buffer.py.
+
+class MagnetLinkConsumer(AsyncJsonWebsocketConsumer):
 
-    def connect(self):
+    async def connect(self):
         self.user = self.scope["user"]
         self.user_group_name = f"user_{self.user.id}"
 
         print("self.user", self.user_group_name)
 
         if self.user.is_authenticated:
-            async_to_sync(self.channel_layer.group_add)(
+            await self.channel_layer.group_add(
                 self.user_group_name,
                 self.channel_name
             )
-            MagnetLinkConsumer.active_users.add(self.user_group_name)
-            self.accept()
+            await database_sync_to_async(presence.join)(self.user.id, self.channel_name)
+            await self.accept()
         else:
-            self.close()
+            await self.close()
 
-    def disconnect(self, close_code):
+    async def disconnect(self, close_code):
         if hasattr(self, "user_group_name"):
-            async_to_sync(self.channel_layer.group_discard)(
+            await self.channel_layer.group_discard(
                 self.user_group_name,
                 self.channel_name
             )
-            if self.user_group_name in MagnetLinkConsumer.active_users:
-                MagnetLinkConsumer.active_users.remove(self.user_group_name)
+            await database_sync_to_async(presence.leave)(self.channel_name)
 
-    def receive(self, text_data):
+    async def receive_json(self, content):
         pass
 
-    def magnet_message(self, event):
+    async def magnet_message(self, event):
         message = event["message"]
-        self.send(text_data=json.dumps({"magnet": message}))
+        await self.send_json({"magnet": message})
 
-    @classmethod
-    def get_active_users(cls):
-        return cls.active_users
 
-
-class GroupChatConsumer(WebsocketConsumer):
-    def connect(self):
+class GroupChatConsumer(AsyncJsonWebsocketConsumer):
+    async def connect(self):
         self.user = self.scope["user"]
         self.group_id = self.scope["url_route"]["kwargs"]["group_id"]
         self.group_name = f"chat_{self.group_id}"
 
         # Check if user is authenticated and is a member of the group
-        if self.user.is_authenticated and self.user.groups.filter(id=self.group_id).exists():
+        if self.user.is_authenticated and await ais_member(self.user, self.group_id):
             # Join the group channel
-            async_to_sync(self.channel_layer.group_add)(
+            await self.channel_layer.group_add(
                 self.group_name,
                 self.channel_name
             )
-            self.accept()
+            await self.accept()
         else:
-            self.close()
+            await self.close()
 
-    def disconnect(self, close_code):
+    async def disconnect(self, close_code):
         # Leave the group channel
         if hasattr(self, "group_name"):
-            async_to_sync(self.channel_layer.group_discard)(
+            await self.channel_layer.group_discard(
                 self.group_name,
                 self.channel_name
             )
 
-    def receive(self, text_data):
-        # Parse the received message
-        data = json.loads(text_data)
-        message_content = data.get("message", "")
-        
+    async def receive_json(self, content):
+        message_content = content.get("message", "")
+
         if message_content:
-            # Save the message to the database
-            try:
-                group = Group.objects.get(id=self.group_id)
-                message = Message.objects.create(
-                    group=group,
-                    sender=self.user,
-                    content=message_content
-                )
-                
-                # Serialize the message
-                serializer = MessageSerializer(message)
-                message_data = serializer.data
-                
-                # Broadcast the message to the group
-                async_to_sync(self.channel_layer.group_send)(
-                    self.group_name,
-                    {
-                        "type": "chat_message",
-                        "message": message_data
-                    }
-                )
-            except Group.DoesNotExist:
-                self.send(text_data=json.dumps({
-                    "error": "Group not found"
-                }))
-    
-    def chat_message(self, event):
+            # Broadcast the message right away, it is stored in the background
+            message = Message(group_id=self.group_id, sender=self.user, content=message_content)
+            await chat_message_buffer.aadd(message)
+
+            await self.channel_layer.group_send(
+                self.group_name,
+                {
+                    "type": "chat_message",
+                    "message": MessageSerializer(message).data
+                }
+            )
+
+    async def chat_message(self, event):
         # Send message to WebSocket
         message = event["message"]
-        self.send(text_data=json.dumps({
+        await self.send_json({
             "message": message
-        }))
+        })
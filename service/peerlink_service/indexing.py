@@ -0,0 +1,199 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from .constants import INDEX_BATCH_SIZE, INDEX_BATCH_WINDOW, INDEX_MAX_ATTEMPTS, INDEX_RETRY_BASE_DELAY, INDEX_RETRY_MAX_DELAY
+from .access_index import get_group_ids_by_file_hashes
+from .models import AccessSyncTask, IndexTask
+from .search import bulk_index_files, update_files_groups
+from .search_cache import bump_group_versions
+
+
+# the magnet link is the _id of the file's document, which Elasticsearch limits to 512 bytes
+MAGNET_LINK_MAX_BYTES = 512
+
+
+def validate_metadata(metadata):
+    """returns why `metadata` cannot be indexed, or None if it can"""
+    if not isinstance(metadata, dict):
+        return "Metadata must be an object."
+    if not isinstance(metadata.get("magnetLink"), str) or not metadata["magnetLink"]:
+        return "magnetLink is required."
+    if len(metadata["magnetLink"].encode()) > MAGNET_LINK_MAX_BYTES:
+        return f"magnetLink cannot be longer than {MAGNET_LINK_MAX_BYTES} bytes."
+    if not isinstance(metadata.get("hash"), str) or not metadata["hash"]:
+        return "hash is required."
+    return None
+
+
+def enqueue_metadata(metadata):
+    """stores `metadata` in the outbox, the worker is woken up once the surrounding transaction commits"""
+    task = IndexTask.objects.create(magnetLink=metadata["magnetLink"], document=metadata)
+    transaction.on_commit(index_worker.wake)
+    return task
+
+
+def enqueue_access_sync(file_hash, group_id):
+    """queues the update of the groups on the documents of `file_hash` after an Access row of `group_id` changed"""
+    AccessSyncTask.objects.create(file_hash=file_hash, group_id=group_id)
+    transaction.on_commit(index_worker.wake)
+
+
+def index_documents(documents):
+    """
+    indexes metadata documents with `bulk_index_files`. an Access change committed while they were being written
+    may have been applied to the index before them, so the groups are read again afterwards and the files whose
+    groups changed meanwhile get an access sync
+    """
+    file_hashes = {metadata.get("hash") for metadata in documents}
+    group_ids_by_hash = get_group_ids_by_file_hashes(file_hashes)
+    results = bulk_index_files(documents, group_ids_by_hash)
+
+    current = get_group_ids_by_file_hashes(file_hashes)
+    stale = [
+        AccessSyncTask(file_hash=file_hash, group_id=group_id)
+        for file_hash in file_hashes
+        for group_id in set(group_ids_by_hash.get(file_hash, [])) ^ set(current.get(file_hash, []))
+    ]
+    if stale:
+        AccessSyncTask.objects.bulk_create(stale)
+        transaction.on_commit(index_worker.wake)
+
+    return results
+
+
+def retry_delay(attempts):
+    """exponential backoff: INDEX_RETRY_BASE_DELAY, 2x, 4x, ... capped at INDEX_RETRY_MAX_DELAY seconds"""
+    return min(INDEX_RETRY_BASE_DELAY * 2 ** (attempts - 1), INDEX_RETRY_MAX_DELAY)
+
+
+def index_pending_batch():
+    """
+    indexes the next batch of due outbox documents with one bulk request.
+    documents that were indexed are removed, the others are retried later.
+    returns the number of documents in the batch
+    """
+    with transaction.atomic():
+        # several processes may drain the outbox at once, each takes the rows nobody else holds
+        tasks = list(
+            IndexTask.objects.select_for_update(skip_locked=True)
+            .filter(next_attempt_at__lte=timezone.now(), attempts__lt=INDEX_MAX_ATTEMPTS)
+            .order_by("created_at")[:INDEX_BATCH_SIZE]
+        )
+        if not tasks:
+            return 0
+
+        try:
+            results = index_documents([task.document for task in tasks])
+        except Exception as e:
+            results = [{"error": str(e)}] * len(tasks)
+
+        done, failed = [], []
+        for task, result in zip(tasks, results):
+            if "error" not in result:
+                done.append(task.id)
+                continue
+
+            task.attempts += 1
+            task.last_error = str(result["error"])
+            task.next_attempt_at = timezone.now() + timedelta(seconds=retry_delay(task.attempts))
+            failed.append(task)
+
+        IndexTask.objects.filter(id__in=done).delete()
+        IndexTask.objects.bulk_update(failed, ["attempts", "last_error", "next_attempt_at"])
+
+    return len(tasks)
+
+
+def sync_pending_access():
+    """
+    copies the current groups of the next batch of files with an access sync onto their documents, with one update by query.
+    returns the number of synced rows, 0 if there were none or the documents changed meanwhile (they are retried later)
+    """
+    with transaction.atomic():
+        tasks = list(AccessSyncTask.objects.select_for_update(skip_locked=True).order_by("created_at")[:INDEX_BATCH_SIZE])
+        if not tasks:
+            return 0
+
+        # read after taking the rows, so this sees at least the Access changes that queued them
+        file_hashes = {task.file_hash for task in tasks}
+        group_ids_by_hash = get_group_ids_by_file_hashes(file_hashes)
+        resp = update_files_groups({file_hash: group_ids_by_hash.get(file_hash, []) for file_hash in file_hashes})
+        if resp.get("version_conflicts"):
+            # a document was (re)indexed while being updated, which queues its own sync if its groups were stale;
+            # the rows are kept anyway and retried by the next poll
+            return 0
+
+        AccessSyncTask.objects.filter(id__in=[task.id for task in tasks]).delete()
+
+    bump_group_versions(task.group_id for task in tasks)
+    return len(tasks)
+
+
+def drain_outbox():
+    """indexes due outbox documents and syncs the groups of changed files until there are none left"""
+    while index_pending_batch() or sync_pending_access():
+        pass
+
+
+def outbox_status():
+    """returns the backlog of the outbox and how far behind the oldest waiting document is"""
+    stats = IndexTask.objects.aggregate(
+        pending=Count("id", filter=Q(attempts__lt=INDEX_MAX_ATTEMPTS)),
+        retrying=Count("id", filter=Q(attempts__gt=0, attempts__lt=INDEX_MAX_ATTEMPTS)),
+        failed=Count("id", filter=Q(attempts__gte=INDEX_MAX_ATTEMPTS)),
+        oldest_pending_at=Min("created_at", filter=Q(attempts__lt=INDEX_MAX_ATTEMPTS)),
+    )
+
+    stats["access_pending"] = AccessSyncTask.objects.count()
+
+    oldest = stats["oldest_pending_at"]
+    stats["lag_seconds"] = round((timezone.now() - oldest).total_seconds(), 3) if oldest else 0
+    return stats
+
+
+class IndexWorker:
+    """
+    Drains the indexing outbox on a background thread of this process.
+    It sleeps until woken up by a new document (or by the scheduler, which covers documents left over
+    from a restart or waiting for a retry), then waits INDEX_BATCH_WINDOW seconds so that documents
+    arriving together are sent in the same bulk request.
+    """
+
+    def __init__(self, window=INDEX_BATCH_WINDOW):
+        self.window = window
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def wake(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="index-worker", daemon=True)
+                self.thread.start()
+        self.event.set()
+
+    def _run(self):
+        while True:
+            self.event.wait()
+            self.event.clear()
+            time.sleep(self.window)
+
+            try:
+                drain_outbox()
+            except Exception as e:
+                print("Indexing outbox could not be drained:", e)
+            finally:
+                close_old_connections()
+
+
+index_worker = IndexWorker()
+
+
+def wake_index_worker():
+    """scheduler job: job stores keep module level functions, not bound methods like `index_worker.wake`"""
+    index_worker.wake()
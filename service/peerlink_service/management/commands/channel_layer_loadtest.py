@@ -0,0 +1,130 @@
+import asyncio
+import multiprocessing
+import queue
+import statistics
+import time
+
+import django
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# The groups are named apart from the `user_<id>` and `chat_<id>` groups of the consumers,
+# so that the test can run against the channel layer of a live deployment.
+USER_GROUP = "loadtest_user_{}"
+CHAT_GROUP = "loadtest_chat"
+
+
+def _receive(index, expected, timeout, ready, results):
+    # runs in a process of its own, like a consumer in another Daphne process
+    django.setup()
+    results.put(asyncio.run(_areceive(index, expected, timeout, ready)))
+
+
+async def _areceive(index, expected, timeout, ready):
+    channel_layer = get_channel_layer()
+    channel_name = await channel_layer.new_channel()
+    await channel_layer.group_add(USER_GROUP.format(index), channel_name)
+    await channel_layer.group_add(CHAT_GROUP, channel_name)
+    ready.put(index)
+
+    received = {"magnet_message": 0, "chat_message": 0}
+    latencies = []
+    deadline = time.monotonic() + timeout
+    while sum(received.values()) < expected:
+        try:
+            message = await asyncio.wait_for(channel_layer.receive(channel_name), deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            break
+        received[message["type"]] += 1
+        latencies.append(time.time() - message["sent_at"])
+
+    await channel_layer.group_discard(USER_GROUP.format(index), channel_name)
+    await channel_layer.group_discard(CHAT_GROUP, channel_name)
+    return index, received, latencies
+
+
+async def _send(receivers, messages, concurrency):
+    channel_layer = get_channel_layer()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(group_name, message):
+        async with semaphore:
+            await channel_layer.group_send(group_name, {**message, "sent_at": time.time()})
+
+    sends = []
+    for i in range(messages):
+        # the shapes of the messages the backup job and the group chat send
+        sends.append(send(CHAT_GROUP, {"type": "chat_message", "message": {"id": i, "content": f"load test message {i}"}}))
+        for index in range(receivers):
+            sends.append(send(USER_GROUP.format(index), {"type": "magnet_message", "message": f"magnet:?xt=urn:btih:{index:020x}{i:020x}"}))
+    await asyncio.gather(*sends)
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends magnet_message and chat_message events through the configured channel layer to consumers "
+        "running in other processes, and reports how many arrived and how long they took."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--receivers", type=int, default=4, help="receiving processes, each one is a user with a socket in the chat")
+        parser.add_argument("--messages", type=int, default=200, help="magnet links sent to every receiver, and chat messages sent to the chat")
+        parser.add_argument("--concurrency", type=int, default=50, help="most group sends in flight at once")
+        parser.add_argument("--timeout", type=float, default=30, help="seconds the receivers wait for the messages")
+
+    def handle(self, *args, **options):
+        receivers, messages, timeout = options["receivers"], options["messages"], options["timeout"]
+        backend = settings.CHANNEL_LAYERS["default"]["BACKEND"]
+        self.stdout.write(f"Channel layer: {backend}")
+        if backend == "channels.layers.InMemoryChannelLayer":
+            self.stderr.write("The in-memory channel layer does not deliver across processes, set CHANNEL_LAYER_BACKEND=redis.")
+
+        context = multiprocessing.get_context("spawn")
+        ready, results = context.Queue(), context.Queue()
+        processes = [
+            context.Process(target=_receive, args=(index, 2 * messages, timeout, ready, results), daemon=True)
+            for index in range(receivers)
+        ]
+        for process in processes:
+            process.start()
+
+        try:
+            for _ in processes:
+                ready.get(timeout=timeout)
+        except queue.Empty:
+            raise CommandError("The receivers did not join their groups in time.")
+
+        started = time.monotonic()
+        asyncio.run(_send(receivers, messages, options["concurrency"]))
+        sent_in = time.monotonic() - started
+
+        received = {"magnet_message": 0, "chat_message": 0}
+        latencies = []
+        try:
+            for _ in processes:
+                index, counts, process_latencies = results.get(timeout=timeout + 10)
+                for type, count in counts.items():
+                    received[type] += count
+                latencies.extend(process_latencies)
+        except queue.Empty:
+            raise CommandError("The receivers did not report back in time.")
+        finally:
+            for process in processes:
+                process.join(timeout=5)
+
+        expected = receivers * messages
+        self.stdout.write(f"Sent {2 * expected} messages in {sent_in:.2f}s ({2 * expected / max(sent_in, 1e-6):.0f}/s).")
+        for type, count in received.items():
+            self.stdout.write(f"{type}: {count}/{expected} delivered")
+        if latencies:
+            latencies.sort()
+            self.stdout.write(
+                f"latency ms: median {1000 * statistics.median(latencies):.1f}, "
+                f"p99 {1000 * latencies[int(0.99 * (len(latencies) - 1))]:.1f}, max {1000 * latencies[-1]:.1f}"
+            )
+
+        if any(count < expected for count in received.values()):
+            raise CommandError("Some messages were not delivered.")
+        self.stdout.write(self.style.SUCCESS("Every message reached its receiver process."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ...recommendations import refresh_file_similarities
+
+
+class Command(BaseCommand):
+    help = "Recomputes the file similarities recommendations are made from, without waiting for the scheduled job."
+
+    def handle(self, *args, **options):
+        count = refresh_file_similarities()
+        self.stdout.write(self.style.SUCCESS(f"Stored {count} file similarities."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from ...chat_buffer import orphan_segments, replay_segment
+
+
+class Command(BaseCommand):
+    help = "Stores the chat messages journaled by server processes that stopped before storing them."
+
+    def handle(self, *args, **options):
+        segments = orphan_segments()
+        replayed = 0
+        for path in segments:
+            count = replay_segment(path)
+            self.stdout.write(f"{path}: {count} messages")
+            replayed += count
+
+        self.stdout.write(self.style.SUCCESS(f"Replayed {replayed} messages from {len(segments)} journal segments."))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from ...search import reindex_files_in_place, setup_files_index
+
+
+class Command(BaseCommand):
+    help = "Installs the analyzers and mappings of the files index and re-indexes the existing documents with them."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--skip-reindex",
+            action="store_true",
+            help="Only update the template and mappings, leave the existing documents as they are.",
+        )
+
+    def handle(self, *args, **options):
+        result = setup_files_index()
+        if result == "created":
+            self.stdout.write(self.style.SUCCESS("Created the files index."))
+            return
+        if result == "rebuilt":
+            self.stdout.write(self.style.SUCCESS("Some fields had another type, rebuilt the files index with the current mappings."))
+            return
+
+        self.stdout.write("Updated the settings and mappings of the files index.")
+
+        if options["skip_reindex"]:
+            return
+
+        resp = reindex_files_in_place()
+        self.stdout.write(self.style.SUCCESS(f"Re-indexed {resp['updated']} documents, {len(resp['failures'])} failed."))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from ...access_index import get_group_ids_by_file_hash
+from ...search import bulk_update_file_groups
+
+
+class Command(BaseCommand):
+    help = "Copies the groups of every file from the Access table onto its Elasticsearch documents (group_ids)."
+
+    def handle(self, *args, **options):
+        group_ids_by_hash = get_group_ids_by_file_hash()
+        self.stdout.write(f"Loaded access of {len(group_ids_by_hash)} files.")
+
+        updated, errors = bulk_update_file_groups(group_ids_by_hash)
+        for error in errors:
+            self.stderr.write(str(error))
+
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} documents, {len(errors)} failed."))
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peerlink_service', '0017_report'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('magnetLink', models.CharField(max_length=256)),
+                ('document', models.JSONField()),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['next_attempt_at'], name='peerlink_se_next_at_d544d7_idx')],
+            },
+        ),
+    ]
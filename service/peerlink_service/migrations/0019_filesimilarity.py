@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peerlink_service', '0018_indextask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileSimilarity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_hash', models.CharField(max_length=64)),
+                ('similar_file_hash', models.CharField(max_length=64)),
+                ('score', models.FloatField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['file_hash', '-score'], name='peerlink_se_file_ha_f06125_idx')],
+                'unique_together': {('file_hash', 'similar_file_hash')},
+            },
+        ),
+    ]
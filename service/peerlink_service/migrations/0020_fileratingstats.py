@@ -0,0 +1,52 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:40
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, Q, Sum
+
+
+def fill_file_rating_stats(apps, schema_editor):
+    Rating = apps.get_model('peerlink_service', 'Rating')
+    FileRatingStats = apps.get_model('peerlink_service', 'FileRatingStats')
+
+    stars = {f'stars_{value}': Count('id', filter=Q(rating=value)) for value in range(1, 6)}
+    rows = Rating.objects.values('file_hash').annotate(
+        rating_sum=Sum('rating'),
+        rating_count=Count('id'),
+        average=Avg('rating'),
+        **stars,
+    )
+    FileRatingStats.objects.bulk_create([FileRatingStats(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peerlink_service', '0019_filesimilarity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileRatingStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_hash', models.CharField(max_length=64, unique=True)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('rating_count', models.IntegerField(default=0)),
+                ('average', models.FloatField(default=0)),
+                ('stars_1', models.IntegerField(default=0)),
+                ('stars_2', models.IntegerField(default=0)),
+                ('stars_3', models.IntegerField(default=0)),
+                ('stars_4', models.IntegerField(default=0)),
+                ('stars_5', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['file_hash'], name='peerlink_se_file_ha_ef46ad_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fileratingstats',
+            index=models.Index(fields=['-average', '-rating_count'], name='peerlink_se_average_216e7f_idx'),
+        ),
+        migrations.RunPython(fill_file_rating_stats, migrations.RunPython.noop),
+    ]
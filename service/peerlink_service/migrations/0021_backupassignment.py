@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peerlink_service', '0020_fileratingstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shared',
+            name='file_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='free_space',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='BackupAssignment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('shared', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='backup_assignments', to='peerlink_service.shared')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='backup_assignments', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='peerlink_se_created_8ad657_idx')],
+                'unique_together': {('user', 'shared')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:45
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peerlink_service', '0021_backupassignment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Presence',
+            fields=[
+                ('channel_name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('last_seen', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='presences', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['last_seen'], name='peerlink_se_last_se_5f7c7a_idx'), models.Index(fields=['user', 'last_seen'], name='peerlink_se_user_id_bbe453_idx')],
+            },
+        ),
+    ]
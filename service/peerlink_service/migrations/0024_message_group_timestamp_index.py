@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peerlink_service', '0023_message_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['group', 'timestamp', 'id'], name='peerlink_se_group_i_6fd866_idx'),
+        ),
+    ]
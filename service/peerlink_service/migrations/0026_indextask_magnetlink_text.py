@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('peerlink_service', '0025_accesssynctask'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='indextask',
+            name='magnetLink',
+            field=models.TextField(),
+        ),
+    ]
@@ -1,6 +1,7 @@
 import uuid
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 
@@ -32,6 +33,8 @@ class User(AbstractUser):
     files_shared = models.IntegerField(default=0)
     total_downloads = models.IntegerField(default=0)
     last_active = models.DateTimeField(auto_now=True)
+    # bytes of disk space the client can give to backups, as last reported by it
+    free_space = models.BigIntegerField(null=True, blank=True)
 
     def __str__(self):
         return f"{self.username} ({self.email})"
@@ -53,10 +56,15 @@ class Message(models.Model):
     group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # set when the server receives the message, which may be stored a little later (see chat_buffer.py)
+    timestamp = models.DateTimeField(default=timezone.now)
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # chat history pages, see MessageViewSet.group_messages
+            models.Index(fields=['group', 'timestamp', 'id']),
+        ]
     
     def __str__(self):
         return f"Message from {self.sender.username} in {self.group.name} at {self.timestamp}"
@@ -79,12 +87,51 @@ class Shared(models.Model):
     file_hash = models.CharField(primary_key=True, max_length=64, blank=False, editable=False)
     file_name = models.CharField(max_length=256, blank=False, editable=False)
     magnetLink = models.CharField(max_length=256, blank=False, editable=False)
+    # in bytes, when the sharer reported it
+    file_size = models.BigIntegerField(null=True, blank=True)
     currently_sharing_users = models.ManyToManyField(User, related_name='currently_sharing_files')
 
     def __str__(self):
         return f"Shared: Currently Sharing Users={[user for user in self.currently_sharing_users.all()]}, File Hash={self.file_hash[:10]}..."
 
 
+class BackupAssignment(models.Model):
+    """
+    A magnet link sent to a user by the backup job, pending until the user starts sharing the file.
+    Pending assignments count as sharers, so the link is not sent again while it is being downloaded.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='backup_assignments')
+    shared = models.ForeignKey(Shared, on_delete=models.CASCADE, related_name='backup_assignments')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'shared')
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"BackupAssignment: User={self.user.username}, File Hash={self.shared_id[:10]}..."
+
+
+class Presence(models.Model):
+    """
+    An open websocket connection of a user, in any server process. See presence.py.
+    """
+    channel_name = models.CharField(max_length=255, primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='presences')
+    last_seen = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_seen']),
+            models.Index(fields=['user', 'last_seen']),
+        ]
+
+    def __str__(self):
+        return f"Presence: User={self.user.username}, Last Seen={self.last_seen}"
+
+
 class Comment(models.Model):
     text = models.CharField(max_length=512, blank=False, editable=False)
     file_hash = models.CharField(max_length=64, blank=False, editable=False)
@@ -101,11 +148,43 @@ class Rating(models.Model):
 
     class Meta:
         unique_together = ('user', 'file_hash')
+        indexes = [
+            models.Index(fields=['file_hash']),
+        ]
 
     def __str__(self):
         return f"Rating: User={self.user.username}, File Hash={self.file_hash[:10]}..., Rating={self.rating}"
 
 
+class FileRatingStats(models.Model):
+    """
+    Running totals of the ratings of a file, kept up to date by rating_stats.py
+    whenever a Rating is created, changed or deleted.
+    """
+    file_hash = models.CharField(max_length=64, unique=True)
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+    average = models.FloatField(default=0)
+    # number of 1, 2, ..., 5 star ratings
+    stars_1 = models.IntegerField(default=0)
+    stars_2 = models.IntegerField(default=0)
+    stars_3 = models.IntegerField(default=0)
+    stars_4 = models.IntegerField(default=0)
+    stars_5 = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # popular files
+            models.Index(fields=['-average', '-rating_count']),
+        ]
+
+    def histogram(self):
+        return {str(stars): getattr(self, f"stars_{stars}") for stars in range(1, 6)}
+
+    def __str__(self):
+        return f"FileRatingStats: File Hash={self.file_hash[:10]}..., Average={self.average:.1f}, Count={self.rating_count}"
+
+
 class FeedBack(models.Model):
     email = models.CharField(max_length=64, blank=False, editable=False)
     text = models.CharField(max_length=512, blank=False, editable=False)
@@ -138,4 +217,54 @@ class Report(models.Model):
         ordering = ['-created_at']
 
     def __str__(self):
-        return f"Report for {self.file.file_name} by {self.reporter.username}"
\ No newline at end of file
+        return f"Report for {self.file.file_name} by {self.reporter.username}"
+
+
+# Files whose groups changed (an Access row of `group_id` was added or removed) and whose Elasticsearch
+# documents still have to get the new `group_ids`, indexing.IndexWorker applies them in bulk and deletes them.
+class AccessSyncTask(models.Model):
+    file_hash = models.CharField(max_length=64)
+    # not a foreign key, the group may be gone already (deleting a group removes its Access rows)
+    group_id = models.UUIDField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"AccessSyncTask: File Hash={self.file_hash[:10]}..., Group={self.group_id}"
+
+
+# Outbox of the metadata documents waiting to be indexed in Elasticsearch.
+# /index-metadata/ only stores a row here, indexing.IndexWorker sends them in bulk and deletes them.
+class IndexTask(models.Model):
+    magnetLink = models.TextField()
+    document = models.JSONField()
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"IndexTask: Magnet Link={self.magnetLink[:30]}..., Attempts={self.attempts}"
+
+
+class FileSimilarity(models.Model):
+    file_hash = models.CharField(max_length=64)
+    similar_file_hash = models.CharField(max_length=64)
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('file_hash', 'similar_file_hash')
+        indexes = [
+            models.Index(fields=['file_hash', '-score']),
+        ]
+
+    def __str__(self):
+        return f"FileSimilarity: {self.file_hash[:10]}... ~ {self.similar_file_hash[:10]}..., Score={self.score:.3f}"
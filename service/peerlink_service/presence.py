@@ -0,0 +1,96 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .constants import PRESENCE_HEARTBEAT_INTERVAL, PRESENCE_TTL
+from .models import Presence
+
+
+# Who is online is kept in the Presence table, one row per open websocket connection, so that every
+# server process (and the backup job, whichever process runs it) sees the connections of all of them.
+# A process refreshes `last_seen` of its own connections every PRESENCE_HEARTBEAT_INTERVAL seconds; the
+# rows of a process that died without closing its connections stop being refreshed, are ignored once
+# they are PRESENCE_TTL seconds old and deleted by the next sweep of any process.
+
+def _online_cutoff():
+    return timezone.now() - timedelta(seconds=PRESENCE_TTL)
+
+
+def join(user_id, channel_name):
+    """records the connection `channel_name` of the user"""
+    Presence.objects.create(channel_name=channel_name, user_id=user_id)
+    presence_heartbeat.track(channel_name, user_id)
+
+
+def leave(channel_name):
+    presence_heartbeat.untrack(channel_name)
+    Presence.objects.filter(channel_name=channel_name).delete()
+
+
+def online_user_ids():
+    """returns the ids of the users with at least one open connection"""
+    return list(Presence.objects.filter(last_seen__gte=_online_cutoff()).values_list("user_id", flat=True).distinct())
+
+
+def is_online(user_id):
+    return Presence.objects.filter(user_id=user_id, last_seen__gte=_online_cutoff()).exists()
+
+
+def sweep():
+    """deletes the connections nobody refreshed within PRESENCE_TTL seconds"""
+    return Presence.objects.filter(last_seen__lt=_online_cutoff()).delete()
+
+
+class PresenceHeartbeat:
+    """
+    Refreshes the Presence rows of the connections of this process, and sweeps expired ones,
+    on a background thread started by the first connection.
+    """
+
+    def __init__(self, interval=PRESENCE_HEARTBEAT_INTERVAL):
+        self.interval = interval
+        # {channel_name: user_id} of the connections of this process
+        self.connections = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def track(self, channel_name, user_id):
+        with self.lock:
+            self.connections[channel_name] = user_id
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="presence-heartbeat", daemon=True)
+                self.thread.start()
+
+    def untrack(self, channel_name):
+        with self.lock:
+            self.connections.pop(channel_name, None)
+
+    def beat(self):
+        with self.lock:
+            connections = dict(self.connections)
+        if connections:
+            refreshed = Presence.objects.filter(channel_name__in=connections).update(last_seen=timezone.now())
+            if refreshed < len(connections):
+                # swept while this process could not report them (e.g. the database was unreachable)
+                Presence.objects.bulk_create(
+                    [Presence(channel_name=channel_name, user_id=user_id) for channel_name, user_id in connections.items()],
+                    ignore_conflicts=True,
+                )
+        sweep()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+
+            try:
+                self.beat()
+            except Exception as e:
+                print("Presence heartbeat failed:", e)
+            finally:
+                close_old_connections()
+
+
+presence_heartbeat = PresenceHeartbeat()
@@ -0,0 +1,151 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast
+
+from .models import FileRatingStats, Rating
+
+
+# FileRatingStats holds the sum, count, average and histogram of the ratings of every file, so that
+# averages and popular files are read from one row per file instead of aggregating the Rating table.
+# Rating changes are applied as deltas in the transaction that changes the ratings: the handlers in
+# signals.py do it for single saves and deletes, bulk writes (`upsert_ratings`) call `apply_rating_changes` themselves.
+
+def apply_rating_changes(changes):
+    """
+    `changes` is an iterable of (file_hash, old_rating, new_rating), old_rating is None for a new rating
+    and new_rating is None for a deleted one.
+    the stats of every file are updated with a single UPDATE of relative amounts, so that concurrent
+    changes of the same file are serialized by its row lock instead of overwriting each other.
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    for file_hash, old_rating, new_rating in changes:
+        delta = deltas[file_hash]
+        if old_rating is not None:
+            delta["rating_sum"] -= old_rating
+            delta["rating_count"] -= 1
+            delta[f"stars_{old_rating}"] -= 1
+        if new_rating is not None:
+            delta["rating_sum"] += new_rating
+            delta["rating_count"] += 1
+            delta[f"stars_{new_rating}"] += 1
+
+    deltas = {file_hash: delta for file_hash, delta in deltas.items() if any(delta.values())}
+    if not deltas:
+        return
+
+    FileRatingStats.objects.bulk_create(
+        [FileRatingStats(file_hash=file_hash) for file_hash in deltas],
+        ignore_conflicts=True,
+    )
+
+    for file_hash, delta in deltas.items():
+        rating_sum = F("rating_sum") + delta["rating_sum"]
+        rating_count = F("rating_count") + delta["rating_count"]
+        FileRatingStats.objects.filter(file_hash=file_hash).update(
+            # the expressions are evaluated against the row before the update
+            average=Case(
+                When(rating_count=-delta["rating_count"], then=Value(0.0)),
+                default=Cast(rating_sum, FloatField()) / rating_count,
+                output_field=FloatField(),
+            ),
+            **{field: F(field) + amount for field, amount in delta.items() if amount},
+        )
+
+
+def upsert_ratings(user, ratings):
+    """
+    sets the ratings `user` gave to files, `ratings` is {file_hash: rating}.
+    all ratings are written by one INSERT ... ON CONFLICT DO UPDATE, whether the user rated the files before or not,
+    and the stats of the files are updated in the same transaction.
+    returns the stored Rating objects (in the order of `ratings`) and the set of the file hashes that were rated for the first time
+    """
+    file_hashes = list(ratings)
+    with transaction.atomic():
+        # every writer of the ratings of a file waits for the others on the stats row of the file,
+        # so the previous ratings read below cannot change before the upsert. the rows are locked in a fixed order.
+        FileRatingStats.objects.bulk_create([FileRatingStats(file_hash=file_hash) for file_hash in file_hashes], ignore_conflicts=True)
+        list(FileRatingStats.objects.select_for_update().filter(file_hash__in=file_hashes).order_by("file_hash").values_list("id", flat=True))
+
+        previous = {
+            file_hash: (rating, created_at)
+            for file_hash, rating, created_at in Rating.objects.filter(user=user, file_hash__in=file_hashes).values_list("file_hash", "rating", "created_at")
+        }
+
+        stored = Rating.objects.bulk_create(
+            [Rating(user=user, file_hash=file_hash, rating=rating) for file_hash, rating in ratings.items()],
+            update_conflicts=True,
+            unique_fields=["user", "file_hash"],
+            update_fields=["rating"],
+        )
+
+        apply_rating_changes(
+            (file_hash, previous[file_hash][0] if file_hash in previous else None, rating)
+            for file_hash, rating in ratings.items()
+        )
+
+    for rating in stored:
+        if rating.file_hash in previous:
+            # an update keeps the creation time of the rating
+            rating.created_at = previous[rating.file_hash][1]
+
+    return stored, set(file_hashes) - previous.keys()
+
+
+def get_file_rating_stats(file_hashes):
+    """returns {file_hash: FileRatingStats} of the given files, files without ratings are left out"""
+    return {stats.file_hash: stats for stats in FileRatingStats.objects.filter(file_hash__in=file_hashes)}
+
+
+def rating_summary(stats):
+    """the JSON shape of a file's rating stats, `stats` is None for a file without ratings"""
+    if stats is None or not stats.rating_count:
+        return {"average": 0, "count": 0, "histogram": {str(stars): 0 for stars in range(1, 6)}}
+
+    return {
+        "average": round(stats.average, 1),
+        "count": stats.rating_count,
+        "histogram": stats.histogram(),
+    }
+
+
+def _summaries(file_hashes, stats, own_ratings):
+    summaries = {}
+    for file_hash in file_hashes:
+        file_stats = stats.get(file_hash)
+        summaries[file_hash] = {
+            "average": round(file_stats.average, 1) if file_stats and file_stats.rating_count else 0,
+            "count": file_stats.rating_count if file_stats else 0,
+            "my_rating": own_ratings.get(file_hash),
+        }
+    return summaries
+
+
+def get_rating_summaries(file_hashes, user):
+    """
+    returns {file_hash: {"average", "count", "my_rating"}} for the given files with two queries,
+    "my_rating" is the rating `user` gave the file, None if they didn't rate it (or are anonymous)
+    """
+    file_hashes = list(dict.fromkeys(file_hashes))
+    stats = get_file_rating_stats(file_hashes)
+
+    own_ratings = {}
+    if user.is_authenticated:
+        own_ratings = dict(Rating.objects.filter(user=user, file_hash__in=file_hashes).values_list("file_hash", "rating"))
+
+    return _summaries(file_hashes, stats, own_ratings)
+
+
+async def aget_rating_summaries(file_hashes, user):
+    file_hashes = list(dict.fromkeys(file_hashes))
+    stats = {stats.file_hash: stats async for stats in FileRatingStats.objects.filter(file_hash__in=file_hashes)}
+
+    own_ratings = {}
+    if user.is_authenticated:
+        own_ratings = {
+            file_hash: rating
+            async for file_hash, rating in Rating.objects.filter(user=user, file_hash__in=file_hashes).values_list("file_hash", "rating")
+        }
+
+    return _summaries(file_hashes, stats, own_ratings)
@@ -0,0 +1,85 @@
+import numpy as np
+from scipy import sparse
+from django.db import transaction
+from django.db.models import Sum
+
+from .constants import RECOMMENDATION_NEIGHBOURS
+from .models import FileSimilarity, Rating
+
+
+# Recommendations are item based: two files are similar when the same users rated them alike.
+# The similarities are computed from the whole Rating table by a scheduled job and only the
+# RECOMMENDATION_NEIGHBOURS most similar files of every file are stored, in FileSimilarity.
+# Recommending is then a single indexed lookup of the neighbours of the files the user liked.
+
+def compute_file_similarities(ratings, neighbours=RECOMMENDATION_NEIGHBOURS):
+    """
+    `ratings` is an iterable of (user_id, file_hash, rating).
+    returns {file_hash: [(similar_file_hash, score)]}, the `neighbours` most similar files of every file,
+    most similar first. the score is the cosine similarity of the rating vectors of the two files, in (0, 1].
+    """
+    users, files = {}, {}
+    rows, columns, values = [], [], []
+    for user_id, file_hash, rating in ratings:
+        rows.append(files.setdefault(file_hash, len(files)))
+        columns.append(users.setdefault(user_id, len(users)))
+        values.append(rating)
+
+    if not files:
+        return {}
+
+    # one row per file, one column per user
+    matrix = sparse.csr_matrix((np.array(values, dtype=np.float64), (rows, columns)), shape=(len(files), len(users)))
+    norms = np.sqrt(matrix.multiply(matrix).sum(axis=1)).A1
+    normalized = sparse.diags(1 / norms) @ matrix
+
+    # only files rated by a common user get a non zero entry
+    similarities = (normalized @ normalized.T).tocsr()
+    similarities.setdiag(0)
+    similarities.eliminate_zeros()
+
+    file_hashes = list(files)
+    result = {}
+    for row in range(similarities.shape[0]):
+        start, end = similarities.indptr[row], similarities.indptr[row + 1]
+        scores, indices = similarities.data[start:end], similarities.indices[start:end]
+        if len(scores) > neighbours:
+            top = np.argpartition(-scores, neighbours)[:neighbours]
+            scores, indices = scores[top], indices[top]
+
+        order = np.argsort(-scores, kind="stable")
+        result[file_hashes[row]] = [(file_hashes[indices[i]], float(scores[i])) for i in order]
+
+    return result
+
+
+def refresh_file_similarities():
+    """recomputes FileSimilarity from the Rating table, readers see either the old or the new table"""
+    ratings = Rating.objects.values_list("user_id", "file_hash", "rating").iterator(chunk_size=10000)
+    similarities = compute_file_similarities(ratings)
+
+    rows = [
+        FileSimilarity(file_hash=file_hash, similar_file_hash=similar_file_hash, score=score)
+        for file_hash, neighbours in similarities.items()
+        for similar_file_hash, score in neighbours
+    ]
+    with transaction.atomic():
+        FileSimilarity.objects.all().delete()
+        FileSimilarity.objects.bulk_create(rows, batch_size=1000)
+
+    return len(rows)
+
+
+def similar_files(file_hashes, exclude, limit):
+    """
+    returns a queryset of the hashes of the `limit` files most similar to `file_hashes` as a whole
+    (by the sum of their similarities), leaving out `exclude`
+    """
+    return (
+        FileSimilarity.objects.filter(file_hash__in=file_hashes)
+        .exclude(similar_file_hash__in=exclude)
+        .values("similar_file_hash")
+        .annotate(total_score=Sum("score"))
+        .order_by("-total_score")
+        .values_list("similar_file_hash", flat=True)[:limit]
+    )
@@ -0,0 +1,100 @@
+from datetime import timedelta
+
+from django.db.models import Count, F, FloatField, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .constants import REPLICATION_ASSIGNMENT_TIMEOUT, REPLICATION_MAX_ASSIGNMENTS_PER_USER, REPLICATION_MAX_FILES_PER_CYCLE
+from .models import BackupAssignment, FileRatingStats, Shared, User
+
+
+# The backup job keeps every shared file seeded by at least `threshold` users. Instead of counting the
+# sharers of every file one by one, the planner asks the database for the under-replicated files only,
+# with a single grouped query, and decides who gets which magnet link for the whole cycle at once.
+# A magnet link sent to a user is recorded as a BackupAssignment and counts as a sharer until the user
+# starts sharing the file (see signals.py) or REPLICATION_ASSIGNMENT_TIMEOUT minutes pass.
+
+def under_replicated_files(threshold, limit=REPLICATION_MAX_FILES_PER_CYCLE):
+    """
+    returns up to `limit` shared files with less than `threshold` sharers and pending backups as dicts of
+    file_hash, magnetLink, file_size, sharers, pending and deficit (the number of missing sharers).
+    the files missing the most sharers come first, then the most rated and best rated ones.
+    """
+    stats = FileRatingStats.objects.filter(file_hash=OuterRef("file_hash"))
+
+    return list(
+        Shared.objects.annotate(
+            sharers=Count("currently_sharing_users", distinct=True),
+            pending=Count("backup_assignments", distinct=True),
+        )
+        .annotate(deficit=Value(threshold) - F("sharers") - F("pending"))
+        .filter(deficit__gt=0)
+        .annotate(
+            rating_count=Coalesce(Subquery(stats.values("rating_count")[:1]), 0, output_field=IntegerField()),
+            rating_average=Coalesce(Subquery(stats.values("average")[:1]), 0.0, output_field=FloatField()),
+        )
+        .order_by("-deficit", "-rating_count", "-rating_average", "file_hash")
+        .values("file_hash", "magnetLink", "file_size", "sharers", "pending", "deficit")[:limit]
+    )
+
+
+def plan_replication(files, user_ids, max_per_user=REPLICATION_MAX_ASSIGNMENTS_PER_USER):
+    """
+    returns the backup assignments of a cycle as (user_id, file) pairs, every file in `files`
+    (see `under_replicated_files`) going to up to as many of the users `user_ids` as it misses sharers.
+    a file is never given to a user who already shares it or was already sent it, nor to one who reported
+    less free space than its size. each user gets at most `max_per_user` files, and the users seeding the
+    fewest files (counting the backups still pending and the ones of this cycle) are chosen first,
+    the ones with the most free space among them.
+    """
+    users = {
+        user["id"]: user
+        for user in User.objects.filter(id__in=user_ids).annotate(
+            load=Count("currently_sharing_files", distinct=True) + Count("backup_assignments", distinct=True),
+        ).values("id", "free_space", "load")
+    }
+    if not users or not files:
+        return []
+
+    # who already has or is getting each file
+    file_hashes = [file["file_hash"] for file in files]
+    holders = {file_hash: set() for file_hash in file_hashes}
+    for file_hash, user_id in Shared.currently_sharing_users.through.objects.filter(shared_id__in=file_hashes).values_list("shared_id", "user_id"):
+        holders[file_hash].add(user_id)
+    for file_hash, user_id in BackupAssignment.objects.filter(shared_id__in=file_hashes).values_list("shared_id", "user_id"):
+        holders[file_hash].add(user_id)
+
+    assigned = {user_id: 0 for user_id in users}
+    plan = []
+    for file in files:
+        size = file["file_size"] or 0
+        candidates = [
+            user for user_id, user in users.items()
+            if user_id not in holders[file["file_hash"]]
+            and assigned[user_id] < max_per_user
+            and (user["free_space"] is None or user["free_space"] >= size)
+        ]
+        candidates.sort(key=lambda user: (user["load"] + assigned[user["id"]], -(user["free_space"] or 0)))
+
+        for user in candidates[:file["deficit"]]:
+            assigned[user["id"]] += 1
+            if user["free_space"] is not None:
+                user["free_space"] -= size
+            plan.append((user["id"], file))
+
+    return plan
+
+
+def run_replication_cycle(threshold, user_ids):
+    """
+    gives up the backups pending for too long, plans the cycle for the users `user_ids`
+    and records its assignments as pending. returns the plan (see `plan_replication`)
+    """
+    BackupAssignment.objects.filter(created_at__lt=timezone.now() - timedelta(minutes=REPLICATION_ASSIGNMENT_TIMEOUT)).delete()
+
+    plan = plan_replication(under_replicated_files(threshold), user_ids)
+    BackupAssignment.objects.bulk_create(
+        [BackupAssignment(user_id=user_id, shared_id=file["file_hash"]) for user_id, file in plan],
+        ignore_conflicts=True,
+    )
+    return plan
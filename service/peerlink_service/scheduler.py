@@ -2,6 +2,9 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
 from django_apscheduler.jobstores import DjangoJobStore
 from .tasks import notify_users
+from .indexing import wake_index_worker
+from .recommendations import refresh_file_similarities
+from .constants import INDEX_POLL_INTERVAL, RECOMMENDATION_REFRESH_MINUTES
 
 def start():
     scheduler = BackgroundScheduler()
@@ -15,6 +18,22 @@ def start():
         replace_existing=True,
     )
 
+    scheduler.add_job(
+        wake_index_worker,
+        'interval',
+        seconds=INDEX_POLL_INTERVAL,
+        id='index_outbox_job',
+        replace_existing=True,
+    )
+
+    scheduler.add_job(
+        refresh_file_similarities,
+        'interval',
+        minutes=RECOMMENDATION_REFRESH_MINUTES,
+        id='file_similarity_job',
+        replace_existing=True,
+    )
+
     scheduler.start()
 
     def job_listener(event):
@@ -1,96 +1,638 @@
-from elasticsearch import Elasticsearch
+import asyncio
+import re
+import threading
+import time
+import weakref
+
+from elasticsearch import AsyncElasticsearch, BadRequestError, Elasticsearch, helpers
 from .constants import *
+from .access_index import get_file_group_ids, get_group_ids_by_file_hashes
+from .search_cache import ascope_version, bump_all_versions, bump_group_versions, scope_version, search_result_cache
+
+
+# The clients are created on first use instead of at import time, so that starting a process
+# (manage.py commands, migrations, ...) neither waits for nor fails on Elasticsearch.
+# Each client keeps a pool of up to ELASTICSEARCH_CONNECTIONS_PER_NODE connections that every request reuses.
+_client = None
+_async_clients = weakref.WeakKeyDictionary()
+_client_lock = threading.Lock()
+
+
+def _client_options():
+    return {
+        "hosts": ELASTICSEARCH_URL,
+        "connections_per_node": ELASTICSEARCH_CONNECTIONS_PER_NODE,
+        "request_timeout": ELASTICSEARCH_REQUEST_TIMEOUT,
+        "max_retries": ELASTICSEARCH_MAX_RETRIES,
+        "retry_on_timeout": True,
+    }
+
+
+def get_client():
+    """returns the process wide Elasticsearch client"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = Elasticsearch(**_client_options())
+    return _client
+
+
+def get_async_client():
+    """
+    returns the AsyncElasticsearch client of the running event loop, for async views.
+    its connections belong to the loop, under Daphne there is a single loop so it is process wide as well.
+    """
+    loop = asyncio.get_running_loop()
+    async_client = _async_clients.get(loop)
+    if async_client is None:
+        async_client = _async_clients[loop] = AsyncElasticsearch(**_client_options())
+    return async_client
+
+
+# Index layout of FILES_INDEX, installed by `manage.py setup_files_index`.
+# Every metadata field the client's `extract` output produces is a string, and each of them gets
+#   - `<field>.keyword` for exact matches, sorting and aggregations (same as Elasticsearch's default mapping)
+#   - `<field>.suggest`, edge n-grams of every word, for typeahead suggestions
+#   - `<field>.ngram`, 2 and 3 character n-grams of every word, for substring searches without wildcards
+FILES_INDEX_SETTINGS = {
+    "analysis": {
+        "tokenizer": {
+            "substring": {
+                "type": "ngram",
+                "min_gram": 2,
+                "max_gram": 3,
+                "token_chars": ["letter", "digit"],
+            },
+            "autocomplete": {
+                "type": "edge_ngram",
+                "min_gram": 1,
+                "max_gram": 20,
+                "token_chars": ["letter", "digit"],
+            },
+            "words": {
+                "type": "pattern",
+                "pattern": "[^\\p{L}\\p{Nd}]+",
+            },
+        },
+        "analyzer": {
+            "substring": {
+                "tokenizer": "substring",
+                "filter": ["lowercase"],
+            },
+            "autocomplete": {
+                "tokenizer": "autocomplete",
+                "filter": ["lowercase"],
+            },
+            "autocomplete_search": {
+                "tokenizer": "words",
+                "filter": ["lowercase"],
+            },
+        },
+    },
+}
+
+STRING_SUBFIELDS = {
+    "keyword": {
+        "type": "keyword",
+        "ignore_above": 256,
+    },
+    "suggest": {
+        "type": "text",
+        "analyzer": "autocomplete",
+        "search_analyzer": "autocomplete_search",
+    },
+    "ngram": {
+        "type": "text",
+        "analyzer": "substring",
+    },
+}
+
+# identifiers are only ever matched as a whole
+EXACT_MATCH_FIELDS = ("hash", "owner_id")
+
+# runs of letters and digits, the `token_chars` of the n-gram tokenizers
+WORD_PATTERN = re.compile(r"[^\W_]+")
+
+FILES_INDEX_MAPPINGS = {
+    "dynamic_templates": [
+        {
+            "strings": {
+                "match_mapping_type": "string",
+                "mapping": {
+                    "type": "text",
+                    "fields": STRING_SUBFIELDS,
+                },
+            },
+        },
+    ],
+    "properties": {
+        # matched as a whole instead of being split on dashes
+        "group_ids": {"type": "keyword"},
+        "filename": {
+            "type": "text",
+            "fields": STRING_SUBFIELDS,
+        },
+        "hash": {
+            "type": "text",
+            "fields": {"keyword": STRING_SUBFIELDS["keyword"]},
+        },
+        "owner_id": {
+            "type": "text",
+            "fields": {"keyword": STRING_SUBFIELDS["keyword"]},
+        },
+        # range filters, the client sends the size in bytes and the upload time in ISO 8601
+        "size": {"type": "long"},
+        "timestamp": {"type": "date"},
+        # lowercase extension of `filename`, set when the file is indexed, for the extension filter and facet
+        "extension": {"type": "keyword"},
+        # a copy of the document's _id, which cannot be sorted on, to break the ties of SEARCH_PAGE_SORT
+        "magnetLink": {"type": "keyword"},
+    },
+}
 
-client = Elasticsearch(hosts=ELASTICSEARCH_URL)
-client.indices.refresh(index=FILES_INDEX)
+# fills `extension` and `magnetLink` of the documents indexed before they existed, see `reindex_files_in_place`
+SET_DERIVED_FIELDS_SCRIPT = """
+ctx._source.magnetLink = ctx._id;
+if (ctx._source.filename instanceof String) {
+    String filename = ctx._source.filename;
+    int dot = filename.lastIndexOf('.');
+    ctx._source.extension = dot > 0 ? filename.substring(dot + 1).toLowerCase() : '';
+}
+"""
+
+
+# the fields of FILES_INDEX_MAPPINGS whose type dynamic mapping would get wrong (e.g. `text` for the group ids)
+# and that need no analyzer, so they can be added to an index set up before FILES_INDEX_SETTINGS existed
+TYPED_FIELDS = ("group_ids", "size", "timestamp", "extension", "magnetLink")
+
+_files_index_ready = False
+_files_index_lock = threading.Lock()
+
+
+def _put_files_index_template(client):
+    client.indices.put_index_template(
+        name=FILES_INDEX_TEMPLATE,
+        # FILES_INDEX may be an alias of a rebuilt index, see `_rebuild_files_index`
+        index_patterns=[FILES_INDEX, f"{FILES_INDEX}-*"],
+        template={
+            "settings": FILES_INDEX_SETTINGS,
+            "mappings": FILES_INDEX_MAPPINGS,
+        },
+    )
+
+
+def ensure_files_index():
+    """
+    makes sure, once per process and before the first document is written, that FILES_INDEX exists with the
+    mappings of TYPED_FIELDS, so that they are never mapped dynamically. the rest is done by `setup_files_index`
+    """
+    global _files_index_ready
+    if _files_index_ready:
+        return
+
+    with _files_index_lock:
+        if _files_index_ready:
+            return
+
+        client = get_client()
+        _put_files_index_template(client)
+        if not client.indices.exists(index=FILES_INDEX):
+            try:
+                client.indices.create(index=FILES_INDEX)
+            except BadRequestError as e:
+                # created by another process meanwhile
+                if e.error != "resource_already_exists_exception":
+                    raise
+        else:
+            try:
+                client.indices.put_mapping(
+                    index=FILES_INDEX,
+                    properties={field: FILES_INDEX_MAPPINGS["properties"][field] for field in TYPED_FIELDS},
+                )
+            except BadRequestError as e:
+                # mapped with another type already, only `setup_files_index` can fix it; writes go on meanwhile
+                print("Files index mappings are out of date, run `manage.py setup_files_index`:", e)
+        _files_index_ready = True
+
+
+def file_extension(filename):
+    """returns the lowercase extension of `filename` without the dot, '' if it has none"""
+    if not isinstance(filename, str):
+        return ""
+    stem, dot, extension = filename.rpartition(".")
+    return extension.lower() if stem and dot else ""
 
 
 def index_file(metadata):
     # we put magnetLink as _id in elasticsearch because it's unique and when we try to index the same magnetLink
     # again it will update the existent entry instead of creating a new one.
     magnetLink = metadata.get("magnetLink")
-    metadata.pop("magnetLink")
 
-    resp = client.index(
+    # the groups that can see the file are kept on the document as well, so that searches can be
+    # filtered by the requester's groups instead of every file hash they have access to
+    metadata["group_ids"] = get_file_group_ids(metadata.get("hash"))
+    metadata["extension"] = file_extension(metadata.get("filename"))
+
+    ensure_files_index()
+    resp = get_client().index(
         index=FILES_INDEX,
         document=metadata,
-        id=magnetLink
+        id=magnetLink,
+        refresh="wait_for"
     )
+    bump_group_versions(metadata["group_ids"])
 
-    print(resp)
     return resp
 
 
+def bulk_index_files(documents, group_ids_by_hash=None):
+    """
+    indexes many metadata documents (same shape as for `index_file`) with a single bulk request.
+    `group_ids_by_hash` are the groups of the files ({file_hash: [group_id]}), read from the Access table if not given.
+    returns one result per document, in order: {"magnetLink", "status", "result"} or {"magnetLink", "status", "error"}
+    """
+    if group_ids_by_hash is None:
+        group_ids_by_hash = get_group_ids_by_file_hashes({metadata.get("hash") for metadata in documents})
+
+    magnetLinks = []
+    actions = []
+    for metadata in documents:
+        metadata = dict(metadata)
+        magnetLink = metadata["magnetLink"]
+        metadata["group_ids"] = group_ids_by_hash.get(metadata.get("hash"), [])
+        metadata["extension"] = file_extension(metadata.get("filename"))
+
+        magnetLinks.append(magnetLink)
+        actions.append({
+            "_op_type": "index",
+            "_index": FILES_INDEX,
+            "_id": magnetLink,
+            "_source": metadata,
+        })
+
+    ensure_files_index()
+    results = []
+    bulk_results = helpers.streaming_bulk(
+        get_client(),
+        actions,
+        chunk_size=BULK_INDEX_CHUNK_SIZE,
+        raise_on_error=False,
+        raise_on_exception=False,
+        # the documents are searchable when we return, so cached results of their groups can be dropped
+        refresh="wait_for",
+    )
+    for magnetLink, (ok, item) in zip(magnetLinks, bulk_results):
+        item = item["index"]
+        if ok:
+            results.append({"magnetLink": magnetLink, "status": item["status"], "result": item["result"]})
+        else:
+            results.append({"magnetLink": magnetLink, "status": item.get("status", 500), "error": item.get("error")})
+
+    bump_group_versions(group_id for action in actions for group_id in action["_source"]["group_ids"])
+
+    return results
+
+
 def update_file(magnetLink, update_fields):
     update_body = {
-        "doc": update_fields,
+        # a document created by the upsert gets its `magnetLink` as well
+        "doc": {**update_fields, "magnetLink": magnetLink},
         "doc_as_upsert": True,
     }
 
-    response = es.update(index=FILES_INDEX, id=magnetLink, body=update_body)
+    ensure_files_index()
+    response = get_client().update(index=FILES_INDEX, id=magnetLink, body=update_body, refresh="wait_for")
+    # we don't know the groups of the document without fetching it, so every cached result is dropped
+    bump_all_versions()
 
     return response
 
 
-def search_file(search_term, allowed_file_hashes, search_by_metadata):
+def _conflicting_fields(client):
+    """the fields of FILES_INDEX_MAPPINGS that FILES_INDEX has with another type, e.g. `group_ids` mapped dynamically"""
+    conflicts = set()
+    for mapping in client.indices.get_mapping(index=FILES_INDEX).values():
+        existing = mapping["mappings"].get("properties", {})
+        for field, field_mapping in FILES_INDEX_MAPPINGS["properties"].items():
+            if field in existing and existing[field].get("type", "object") != field_mapping["type"]:
+                conflicts.add(field)
+    return conflicts
+
+
+def _rebuild_files_index(client):
     """
-    searches for `search_term` in all metadata fields
-    returns magnet links and all related metadata
+    the type of a field cannot be changed in place, so the documents are copied into a new index created from the
+    template and FILES_INDEX becomes an alias of it, swapped in one step with the removal of the old index.
+    documents written while the copy runs are lost, so it should run while nothing is being indexed
     """
+    new_index = f"{FILES_INDEX}-{int(time.time())}"
+    client.indices.create(index=new_index)
+    client.reindex(
+        source={"index": FILES_INDEX},
+        dest={"index": new_index},
+        script={"source": SET_DERIVED_FIELDS_SCRIPT},
+        refresh=True,
+        wait_for_completion=True,
+    )
+
+    old_indices = list(client.indices.get(index=FILES_INDEX))
+    client.indices.update_aliases(actions=[
+        *({"remove_index": {"index": old_index}} for old_index in old_indices),
+        {"add": {"index": new_index, "alias": FILES_INDEX}},
+    ])
+    bump_all_versions()
+
+
+def setup_files_index():
+    """
+    installs FILES_INDEX_SETTINGS and FILES_INDEX_MAPPINGS as an index template and applies them to FILES_INDEX,
+    creating the index if it doesn't exist. string fields the index already has get the new subfields, they are
+    filled for the existing documents by `reindex_files_in_place`. an index with a field of another type
+    (e.g. `group_ids` written before its mapping existed) is rebuilt with `_rebuild_files_index`.
+    returns "created", "rebuilt" or "updated"
+    """
+    client = get_client()
+    _put_files_index_template(client)
+
+    if not client.indices.exists(index=FILES_INDEX):
+        client.indices.create(index=FILES_INDEX)
+        return "created"
+
+    if _conflicting_fields(client):
+        _rebuild_files_index(client)
+        return "rebuilt"
+
+    # analyzers can only be added to a closed index
+    client.indices.close(index=FILES_INDEX)
+    try:
+        client.indices.put_settings(index=FILES_INDEX, settings=FILES_INDEX_SETTINGS)
+    finally:
+        client.indices.open(index=FILES_INDEX, wait_for_active_shards="1")
+
+    properties = {}
+    for mapping in client.indices.get_mapping(index=FILES_INDEX).values():
+        for field, field_mapping in mapping["mappings"].get("properties", {}).items():
+            if field_mapping.get("type") == "text" and field not in FILES_INDEX_MAPPINGS["properties"]:
+                properties[field] = {"type": "text", "fields": STRING_SUBFIELDS}
+
+    client.indices.put_mapping(
+        index=FILES_INDEX,
+        dynamic_templates=FILES_INDEX_MAPPINGS["dynamic_templates"],
+        properties={**properties, **FILES_INDEX_MAPPINGS["properties"]},
+    )
+    return "updated"
+
+
+def reindex_files_in_place():
+    """
+    re-indexes every document of FILES_INDEX onto itself so that subfields added to the mapping get populated,
+    fields derived at index time (`extension`, `magnetLink`) are set on the way
+    """
+    return get_client().update_by_query(
+        index=FILES_INDEX,
+        script={"source": SET_DERIVED_FIELDS_SCRIPT},
+        conflicts="proceed",
+        refresh=True,
+    )
+
+
+def update_files_groups(group_ids_by_hash):
+    """
+    sets `group_ids` of every document of the given files (one per magnet link) with a single update by query,
+    `group_ids_by_hash` is {file_hash: [group_id]}. returns the Elasticsearch response
+    """
+    ensure_files_index()
+    return get_client().update_by_query(
+        index=FILES_INDEX,
+        query={"terms": {"hash.keyword": list(group_ids_by_hash)}},
+        script={
+            "source": "ctx._source.group_ids = params.group_ids_by_hash.getOrDefault(ctx._source.hash, [])",
+            "params": {"group_ids_by_hash": group_ids_by_hash},
+        },
+        conflicts="proceed",
+        refresh=True,
+    )
+
+
+def bulk_update_file_groups(group_ids_by_hash):
+    """
+    sets `group_ids` of every document in the index from `group_ids_by_hash`, files without an entry lose their groups.
+    returns the number of updated documents and the list of errors
+    """
+    def actions():
+        for hit in helpers.scan(get_client(), index=FILES_INDEX, _source=["hash"]):
+            file_hash = hit["_source"].get("hash")
+            yield {
+                "_op_type": "update",
+                "_index": FILES_INDEX,
+                "_id": hit["_id"],
+                "doc": {"group_ids": group_ids_by_hash.get(file_hash, [])},
+            }
+
+    ensure_files_index()
+    updated, errors = helpers.bulk(get_client(), actions(), raise_on_error=False, refresh=True)
+    # any group may have gained or lost files, so every cached result is dropped
+    bump_all_versions()
+
+    return updated, errors
+
+
+def search_fields(search_by_metadata):
+    """the metadata fields to match, `search_by_metadata` is a field name or a comma separated list of them"""
+    if isinstance(search_by_metadata, str):
+        search_by_metadata = search_by_metadata.split(",")
+    return tuple(dict.fromkeys(field.strip() for field in search_by_metadata if field.strip())) or ("filename",)
+
+
+def _filter_clauses(filters):
+    """
+    `filters` may have
+      - size_min, size_max: bounds (inclusive) of the size in bytes
+      - timestamp_from, timestamp_to: bounds (inclusive) of the upload time, ISO 8601 dates or Elasticsearch date math
+      - owner_ids: the files of any of these owners
+      - extensions: the files with any of these extensions
+    """
+    filters = filters or {}
+    clauses = []
+
+    for field, lower, upper in (("size", "size_min", "size_max"), ("timestamp", "timestamp_from", "timestamp_to")):
+        bounds = {}
+        if filters.get(lower) is not None:
+            bounds["gte"] = filters[lower]
+        if filters.get(upper) is not None:
+            bounds["lte"] = filters[upper]
+        if bounds:
+            clauses.append({"range": {field: bounds}})
+
+    if filters.get("owner_ids"):
+        clauses.append({"terms": {"owner_id.keyword": [str(owner_id) for owner_id in filters["owner_ids"]]}})
+    if filters.get("extensions"):
+        clauses.append({"terms": {"extension": [extension.lower().lstrip(".") for extension in filters["extensions"]]}})
+
+    return clauses
+
+
+def _search_query(search_term, group_ids, search_by_metadata, filters=None):
+    # We choose the files that the current user has access to
+    access_filter = [
+        {
+            "terms": {
+                "group_ids": list(group_ids)
+            }
+        }
+    ] + _filter_clauses(filters)
+
     if not search_term:
-        resp = client.search(
-            index=FILES_INDEX,
-            body={
-                "query": {
-                    "bool": {
-                        "filter": [
-                            {
-                                "terms": {
-                                    "hash": list(allowed_file_hashes)
-                                }
-                            }
-                        ]
+        return {
+            "bool": {
+                "filter": access_filter
+            }
+        }
+
+    # a file matches if any of the fields matches
+    return {
+        "bool": {
+            "should": [
+                _field_match(search_term, field) for field in search_fields(search_by_metadata)
+            ],
+            "minimum_should_match": 1,
+            "filter": access_filter
+        }
+    }
+
+
+def _facet_aggs(group_ids):
+    return {
+        # files are usually shared with groups the requester isn't in, only theirs are counted
+        "groups": {"terms": {"field": "group_ids", "include": list(group_ids), "size": SEARCH_FACET_SIZE}},
+        "extensions": {"terms": {"field": "extension", "size": SEARCH_FACET_SIZE}},
+        "owners": {"terms": {"field": "owner_id.keyword", "size": SEARCH_FACET_SIZE}},
+    }
+
+
+def _facets(resp):
+    """returns {facet: [{"key", "count"}]}, the most frequent values first"""
+    return {
+        name: [{"key": bucket["key"], "count": bucket["doc_count"]} for bucket in agg["buckets"]]
+        for name, agg in resp.get("aggregations", {}).items()
+    }
+
+
+def _field_match(search_term, field):
+    """
+    matches the files whose `field` contains every word of `search_term` as a substring.
+    the n-grams of each word are looked up in `<field>.ngram` as a phrase, so they have to be adjacent and in the
+    same word like in a `*word*` wildcard, which is what they replace. single characters have no n-grams, so they
+    only match the start of a word.
+    """
+    if field in EXACT_MATCH_FIELDS:
+        return {"term": {f"{field}.keyword": search_term}}
+
+    # the words as split by the `substring` tokenizer
+    words = WORD_PATTERN.findall(search_term)
+    if not words:
+        return {"match_none": {}}
+
+    clauses = [
+        {"match_phrase": {f"{field}.ngram": word}} if len(word) > 1 else {"match": {f"{field}.suggest": word}}
+        for word in words
+    ]
+    return clauses[0] if len(clauses) == 1 else {"bool": {"must": clauses}}
+
+
+# Every search below comes in a sync and an async (a-prefixed) flavour sharing the request it sends
+# to Elasticsearch and the way the response is read.
+
+def suggestion_field_error(field):
+    """
+    returns why there cannot be suggestions for the metadata `field`, or None if there can. suggestions come from
+    the `suggest` and `keyword` subfields, which only the text fields have: not TYPED_FIELDS, a list of fields,
+    a subfield, a pattern or a field of Elasticsearch
+    """
+    if not field or field.strip() != field:
+        return "filter must be a field name."
+    if any(char in field for char in ",.*?") or field.startswith("_"):
+        return "filter must be the name of a single metadata field."
+    if field in TYPED_FIELDS:
+        return f"There are no suggestions for {field}."
+    return None
+
+
+def _suggest_request(prefix, group_ids, field, size):
+    query = _search_query("", group_ids, field)
+    if prefix:
+        query["bool"]["must"] = [
+            {
+                "match": {
+                    f"{field}.suggest": {
+                        "query": prefix,
+                        "operator": "and",
                     }
                 }
-            },
-            size=ELASTICSEARCH_MAX_RESULTS
-        )
-    else:
-        # We choose the files that the current user has access to
-        print("here", allowed_file_hashes)
-        resp = client.search(
-            index=FILES_INDEX,
-            body={
-                "query": {
-                    "bool": {
-                        "should": [
-                            {
-                                "simple_query_string": {
-                                    "query": f"*{search_term}*",
-                                    "fields": [ search_by_metadata ],
-                                    "analyze_wildcard": True,
-                                    "default_operator": "AND",
-                                }
-                            },
-                        ],
-                        "minimum_should_match": 1,
-                        "filter": [
-                            {
-                                "terms": {
-                                    "hash": list(allowed_file_hashes)
-                                }
-                            }
-                        ]
-                    }
+            }
+        ]
+
+    return {
+        "index": FILES_INDEX,
+        "query": query,
+        "aggs": {
+            "suggestions": {
+                "terms": {
+                    "field": f"{field}.keyword",
+                    "size": size,
                 }
-            },
-            size=ELASTICSEARCH_MAX_RESULTS
-        )
+            }
+        },
+        "size": 0,
+        "track_total_hits": False,
+        "request_cache": True,
+    }
+
+
+def _suggestions(resp):
+    return [bucket["key"] for bucket in resp["aggregations"]["suggestions"]["buckets"]]
+
+
+def suggest_field_values(prefix, group_ids, field, size):
+    """
+    returns up to `size` distinct values of the metadata `field` having a word that starts with
+    a word of `prefix`, among the files `group_ids` have access to, most frequent first.
+    only the aggregation is returned by Elasticsearch, no documents.
+    """
+    resp = get_client().search(**_suggest_request(prefix, group_ids, field, size))
+    return _suggestions(resp)
+
+
+async def asuggest_field_values(prefix, group_ids, field, size):
+    resp = await get_async_client().search(**_suggest_request(prefix, group_ids, field, size))
+    return _suggestions(resp)
+
+
+def _hit_to_file(hit):
+    return { **hit["_source"], "magnetLink": hit["_id"]}
+
+
+def _search_request(search_term, group_ids, search_by_metadata, filters=None):
+    return {
+        "index": FILES_INDEX,
+        "query": _search_query(search_term, group_ids, search_by_metadata, filters),
+        "size": ELASTICSEARCH_MAX_RESULTS,
+    }
+
+
+def search_file(search_term, group_ids, search_by_metadata, filters=None):
+    """
+    searches for `search_term` in the `search_by_metadata` fields of the files that `group_ids` have access to,
+    narrowed down by `filters` (see `_filter_clauses`)
+    returns magnet links and all related metadata
+    """
+    resp = get_client().search(**_search_request(search_term, group_ids, search_by_metadata, filters))
 
     # If you want to search via web interface localhost,
     # Comment out above and use below
 
-    # resp = client.search(
+    # resp = get_client().search(
     #     index=FILES_INDEX,
     #     query={
     #         "query_string": {
@@ -104,4 +646,189 @@ def search_file(search_term, allowed_file_hashes, search_by_metadata):
     # for hit in resp["hits"]["hits"]:
     #    print(hit)
 
-    return [{ **hit["_source"], "magnetLink": hit["_id"]} for hit in resp["hits"]["hits"]]
+    return [_hit_to_file(hit) for hit in resp["hits"]["hits"]]
+
+
+async def asearch_file(search_term, group_ids, search_by_metadata, filters=None):
+    resp = await get_async_client().search(**_search_request(search_term, group_ids, search_by_metadata, filters))
+    return [_hit_to_file(hit) for hit in resp["hits"]["hits"]]
+
+
+def _files_by_hashes_request(file_hashes, group_ids):
+    return {
+        "index": FILES_INDEX,
+        "query": {
+            "bool": {
+                "filter": [
+                    {"terms": {"group_ids": list(group_ids)}},
+                    {"terms": {"hash.keyword": list(file_hashes)}},
+                ]
+            }
+        },
+        # a file shared under several magnet links has a document per link, one of them is enough
+        "collapse": {"field": "hash.keyword"},
+        "size": len(file_hashes),
+        "track_total_hits": False,
+    }
+
+
+def _files_in_order(resp, file_hashes):
+    files = {file["hash"]: file for file in map(_hit_to_file, resp["hits"]["hits"])}
+    return [files[file_hash] for file_hash in file_hashes if file_hash in files]
+
+
+def get_files_by_hashes(file_hashes, group_ids):
+    """
+    returns the metadata of the files with `file_hashes` that `group_ids` have access to, with a single request
+    matching the hashes exactly. the files are in the order of `file_hashes`, the ones not found are left out
+    """
+    file_hashes = list(dict.fromkeys(file_hashes))
+    if not file_hashes:
+        return []
+    resp = get_client().search(**_files_by_hashes_request(file_hashes, group_ids))
+    return _files_in_order(resp, file_hashes)
+
+
+async def aget_files_by_hashes(file_hashes, group_ids):
+    file_hashes = list(dict.fromkeys(file_hashes))
+    if not file_hashes:
+        return []
+    resp = await get_async_client().search(**_files_by_hashes_request(file_hashes, group_ids))
+    return _files_in_order(resp, file_hashes)
+
+
+# search_after needs a total order, ties in score are broken by the file hash, then by the upload time and last by
+# the magnet link: a file shared under several magnet links has one document per link, with the same hash
+SEARCH_PAGE_SORT = [
+    {"_score": "desc"},
+    {"hash.keyword": {"order": "asc", "unmapped_type": "keyword"}},
+    {"timestamp": {"order": "desc", "unmapped_type": "date"}},
+    {"magnetLink": {"order": "asc", "unmapped_type": "keyword"}},
+]
+
+
+def _search_page_request(search_term, group_ids, search_by_metadata, page_size, search_after, filters, facets):
+    request = {
+        "index": FILES_INDEX,
+        "query": _search_query(search_term, group_ids, search_by_metadata, filters),
+        "sort": SEARCH_PAGE_SORT,
+        "search_after": search_after,
+        # one extra hit tells us whether there is a next page
+        "size": page_size + 1,
+        "track_total_hits": False,
+    }
+    if facets:
+        # counted over every match, not only this page, in the same request
+        request["aggs"] = _facet_aggs(group_ids)
+    return request
+
+
+def _search_page(resp, page_size, facets):
+    hits = resp["hits"]["hits"]
+    next_search_after = hits[page_size - 1]["sort"] if len(hits) > page_size else None
+
+    return [_hit_to_file(hit) for hit in hits[:page_size]], next_search_after, _facets(resp) if facets else None
+
+
+def search_file_page(search_term, group_ids, search_by_metadata, page_size, search_after=None, filters=None, facets=False):
+    """
+    returns one page of `search_file` results, starting after the hit whose sort values are `search_after`,
+    together with the sort values to pass for the next page (None on the last page)
+    and, if `facets` is set, the counts of the matching files by group, extension and owner (None otherwise)
+    """
+    resp = get_client().search(**_search_page_request(search_term, group_ids, search_by_metadata, page_size, search_after, filters, facets))
+    return _search_page(resp, page_size, facets)
+
+
+async def asearch_file_page(search_term, group_ids, search_by_metadata, page_size, search_after=None, filters=None, facets=False):
+    resp = await get_async_client().search(**_search_page_request(search_term, group_ids, search_by_metadata, page_size, search_after, filters, facets))
+    return _search_page(resp, page_size, facets)
+
+
+def _normalize_term(search_term, fields):
+    search_term = " ".join((search_term or "").split())
+    if not set(fields) & set(EXACT_MATCH_FIELDS):
+        # every analyzer of the searched subfields lowercases
+        search_term = search_term.lower()
+    return search_term
+
+
+def _filters_key(filters):
+    return tuple(sorted(
+        (name, tuple(value) if isinstance(value, (list, tuple, set)) else value)
+        for name, value in (filters or {}).items() if value is not None
+    ))
+
+
+def _cache_key(kind, search_term, group_ids, field, *args):
+    fields = search_fields(field)
+    return (kind, _normalize_term(search_term, fields), fields, scope_version(group_ids), *args)
+
+
+async def _acache_key(kind, search_term, group_ids, field, *args):
+    fields = search_fields(field)
+    return (kind, _normalize_term(search_term, fields), fields, await ascope_version(group_ids), *args)
+
+
+def _cached(key, compute):
+    result = search_result_cache.get(key)
+    if result is None:
+        result = compute()
+        search_result_cache.set(key, result)
+    return result
+
+
+async def _acached(key, compute):
+    result = search_result_cache.get(key)
+    if result is None:
+        result = await compute()
+        search_result_cache.set(key, result)
+    return result
+
+
+def cached_search_file(search_term, group_ids, search_by_metadata, filters=None):
+    """`search_file` through the search result cache, callers get their own copy of the hits"""
+    key = _cache_key("search", search_term, group_ids, search_by_metadata, _filters_key(filters))
+    files = _cached(key, lambda: search_file(search_term, group_ids, search_by_metadata, filters))
+    return [dict(file) for file in files]
+
+
+async def acached_search_file(search_term, group_ids, search_by_metadata, filters=None):
+    key = await _acache_key("search", search_term, group_ids, search_by_metadata, _filters_key(filters))
+    files = await _acached(key, lambda: asearch_file(search_term, group_ids, search_by_metadata, filters))
+    return [dict(file) for file in files]
+
+
+def _copy_facets(facet_counts):
+    """a copy of the facet buckets of a cached page, which callers may change (e.g. to add the group names)"""
+    if facet_counts is None:
+        return None
+    return {name: [dict(bucket) for bucket in buckets] for name, buckets in facet_counts.items()}
+
+
+def cached_search_file_page(search_term, group_ids, search_by_metadata, page_size, search_after=None, filters=None, facets=False):
+    """`search_file_page` through the search result cache, callers get their own copy of the hits and facets"""
+    key = _cache_key("page", search_term, group_ids, search_by_metadata, page_size, repr(search_after), _filters_key(filters), facets)
+    files, next_search_after, facet_counts = _cached(
+        key, lambda: search_file_page(search_term, group_ids, search_by_metadata, page_size, search_after, filters, facets)
+    )
+    return [dict(file) for file in files], next_search_after, _copy_facets(facet_counts)
+
+
+async def acached_search_file_page(search_term, group_ids, search_by_metadata, page_size, search_after=None, filters=None, facets=False):
+    key = await _acache_key("page", search_term, group_ids, search_by_metadata, page_size, repr(search_after), _filters_key(filters), facets)
+    files, next_search_after, facet_counts = await _acached(
+        key, lambda: asearch_file_page(search_term, group_ids, search_by_metadata, page_size, search_after, filters, facets)
+    )
+    return [dict(file) for file in files], next_search_after, _copy_facets(facet_counts)
+
+
+def cached_suggest_field_values(prefix, group_ids, field, size):
+    """`suggest_field_values` through the search result cache"""
+    key = _cache_key("suggest", prefix, group_ids, field, size)
+    return list(_cached(key, lambda: suggest_field_values(prefix, group_ids, field, size)))
+
+
+async def acached_suggest_field_values(prefix, group_ids, field, size):
+    key = await _acache_key("suggest", prefix, group_ids, field, size)
+    return list(await _acached(key, lambda: asuggest_field_values(prefix, group_ids, field, size)))
@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from .constants import SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL
+
+
+# Search results are cached per process in an LRU keyed by the query and by the versions of the groups it
+# is scoped to. The versions live in Django's cache: indexing a file bumps the versions of its groups, an Access
+# change bumps the version of its group and updates whose groups are unknown bump the version shared by all groups.
+# A bump makes the keys built from the old versions unreachable, the stale entries then age out of the LRU.
+
+ALL_GROUPS_VERSION_KEY = "search_version_all"
+
+
+def _group_version_key(group_id):
+    return f"search_version_group_{group_id}"
+
+
+def _bump(key):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # evicted between add and incr
+        cache.set(key, 1, None)
+
+
+def bump_group_versions(group_ids):
+    for group_id in set(group_ids):
+        _bump(_group_version_key(group_id))
+
+
+def bump_all_versions():
+    _bump(ALL_GROUPS_VERSION_KEY)
+
+
+def scope_version(group_ids):
+    """returns the versions of `group_ids` (sorted by group id) and of all groups, as part of a cache key"""
+    group_ids = sorted(str(group_id) for group_id in group_ids)
+    keys = [_group_version_key(group_id) for group_id in group_ids]
+    versions = cache.get_many(keys + [ALL_GROUPS_VERSION_KEY])
+    return tuple(group_ids), tuple(versions.get(key, 0) for key in keys), versions.get(ALL_GROUPS_VERSION_KEY, 0)
+
+
+async def ascope_version(group_ids):
+    group_ids = sorted(str(group_id) for group_id in group_ids)
+    keys = [_group_version_key(group_id) for group_id in group_ids]
+    versions = await cache.aget_many(keys + [ALL_GROUPS_VERSION_KEY])
+    return tuple(group_ids), tuple(versions.get(key, 0) for key in keys), versions.get(ALL_GROUPS_VERSION_KEY, 0)
+
+
+class SearchResultCache:
+    """
+    Thread safe LRU with a time to live, counting hits, misses and evictions.
+    """
+
+    def __init__(self, max_size=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0,
+                "evictions": self.evictions,
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+            }
+
+
+search_result_cache = SearchResultCache()
@@ -36,6 +36,9 @@ class AccessSerializer(serializers.ModelSerializer):
 class MessageSerializer(serializers.ModelSerializer):
     sender_username = serializers.CharField(source='sender.username', read_only=True)
     sender_id = serializers.CharField(source='sender.id', read_only=True)
+    # the ids are rendered as strings already in `.data`, which is also broadcast through the channel layer
+    group = serializers.PrimaryKeyRelatedField(queryset=Group.objects.all(), pk_field=serializers.UUIDField())
+    sender = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), pk_field=serializers.UUIDField())
     
     class Meta:
         model = Message
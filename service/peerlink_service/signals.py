@@ -0,0 +1,84 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .access_index import invalidate_group, invalidate_group_name, invalidate_user
+from .models import Access, BackupAssignment, Group, Membership, Rating, Shared, User
+from .rating_stats import apply_rating_changes
+from .indexing import enqueue_access_sync
+
+
+# Cache entries are dropped only after the surrounding transaction commits, otherwise a concurrent request
+# could reload the old rows into the cache before the change becomes visible.
+
+@receiver([post_save, post_delete], sender=Access)
+def access_changed(sender, instance, **kwargs):
+    group_id = instance.group_id
+    transaction.on_commit(lambda: invalidate_group(group_id))
+    # the Elasticsearch documents of the file keep a copy of its groups, see search.index_file. they are updated by the
+    # index worker, queued in this transaction so that the change cannot be lost and does not wait for Elasticsearch
+    enqueue_access_sync(instance.file_hash, group_id)
+
+
+@receiver([post_save, post_delete], sender=Group)
+def group_changed(sender, instance, **kwargs):
+    group_id = instance.id
+    transaction.on_commit(lambda: invalidate_group_name(group_id))
+
+
+@receiver([post_save, post_delete], sender=Membership)
+def membership_changed(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_user(user_id))
+
+
+# user.groups.add(...) and friends bypass Membership.save(), so they are handled separately
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse and action in ("post_add", "post_remove", "post_clear"):
+        user_ids = [instance.id]
+    elif reverse and action in ("post_add", "post_remove"):
+        user_ids = list(pk_set)
+    elif reverse and action == "pre_clear":
+        # group.members.clear() does not report which users were removed, so we collect them beforehand
+        user_ids = list(Membership.objects.filter(group=instance).values_list("user_id", flat=True))
+    else:
+        return
+
+    transaction.on_commit(lambda: [invalidate_user(user_id) for user_id in user_ids])
+
+
+# The rating stats are updated right away, in the transaction of the rating itself, see rating_stats.py
+
+@receiver(pre_save, sender=Rating)
+def rating_changing(sender, instance, **kwargs):
+    instance._previous_rating = None
+    if instance.pk is not None:
+        previous = Rating.objects.filter(pk=instance.pk)
+        if transaction.get_connection().in_atomic_block:
+            # a concurrent change of the same rating waits for ours, so both deltas are right
+            previous = previous.select_for_update()
+        instance._previous_rating = previous.values_list("rating", flat=True).first()
+
+
+@receiver(post_save, sender=Rating)
+def rating_saved(sender, instance, **kwargs):
+    apply_rating_changes([(instance.file_hash, getattr(instance, "_previous_rating", None), int(instance.rating))])
+    instance._previous_rating = int(instance.rating)
+
+
+@receiver(post_delete, sender=Rating)
+def rating_deleted(sender, instance, **kwargs):
+    apply_rating_changes([(instance.file_hash, int(instance.rating), None)])
+
+
+# a backup is done once the user shares the file, see replication.py
+@receiver(m2m_changed, sender=Shared.currently_sharing_users.through)
+def sharers_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action != "post_add" or not pk_set:
+        return
+
+    if reverse:
+        BackupAssignment.objects.filter(user=instance, shared_id__in=pk_set).delete()
+    else:
+        BackupAssignment.objects.filter(shared=instance, user_id__in=pk_set).delete()
@@ -1,8 +1,9 @@
+import asyncio
+
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
-from .models import Shared
-from .consumers import MagnetLinkConsumer
-from random import randint
+from .presence import online_user_ids
+from .replication import run_replication_cycle
 
 THRESHOLD = 3
 BACKUP_ON = True  # set to False if you don't want to be disturbed by backup messages while developing other stuff
@@ -13,15 +14,15 @@ def notify_users():
         print("Backup is turned off.")
         return
     try:
-        shared_files = Shared.objects.all()
-        for shared_file in shared_files:
-            if shared_file.currently_sharing_users.count() < THRESHOLD:
-                active_users = MagnetLinkConsumer.get_active_users()
-                print(active_users)
+        # users connected to any server process
+        user_ids = online_user_ids()
+        if not user_ids:
+            return
 
-                idx = randint(0, len(active_users) - 1)
+        plan = run_replication_cycle(THRESHOLD, user_ids)
+        print(f"Backup: {len(plan)} magnet links to send.")
 
-                send_message_to_group(list(active_users)[idx], "magnet_message", shared_file.magnetLink)
+        send_messages_to_groups([(f"user_{user_id}", "magnet_message", file["magnetLink"]) for user_id, file in plan])
     except Exception as e:
         print("Exception occurred", e)
 
@@ -36,3 +37,16 @@ def send_message_to_group(group_name, type, message):
         }
     )
 
+
+
+def send_messages_to_groups(messages):
+    """sends many (group_name, type, message) at once, in a single hop to the event loop"""
+    channel_layer = get_channel_layer()
+
+    async def send_all():
+        await asyncio.gather(*(
+            channel_layer.group_send(group_name, {'type': type, 'message': message})
+            for group_name, type, message in messages
+        ))
+
+    async_to_sync(send_all)()
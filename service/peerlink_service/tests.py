@@ -1,3 +1,248 @@
-from django.test import TestCase
+import uuid
+from datetime import timedelta
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from .models import BackupAssignment, FileRatingStats, Group, Message, Rating, Shared, User
+from .rating_stats import apply_rating_changes, upsert_ratings
+from .recommendations import compute_file_similarities
+from .replication import plan_replication
+from .utils import encode_cursor
+from .views import decode_message_cursor, message_cursor, message_next_cursor, message_page
+
+
+class RatingStatsTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice", email="alice@example.com", password="pass")
+        self.bob = User.objects.create_user(username="bob", email="bob@example.com", password="pass")
+
+    def assertStats(self, file_hash, rating_sum, rating_count, average, histogram):
+        stats = FileRatingStats.objects.get(file_hash=file_hash)
+        self.assertEqual(stats.rating_sum, rating_sum)
+        self.assertEqual(stats.rating_count, rating_count)
+        self.assertAlmostEqual(stats.average, average)
+        self.assertEqual([getattr(stats, f"stars_{stars}") for stars in range(1, 6)], histogram)
+
+    def test_insert(self):
+        Rating.objects.create(user=self.alice, file_hash="f1", rating=4)
+        Rating.objects.create(user=self.bob, file_hash="f1", rating=1)
+
+        self.assertStats("f1", 5, 2, 2.5, [1, 0, 0, 1, 0])
+
+    def test_update_moves_the_rating_between_stars(self):
+        rating = Rating.objects.create(user=self.alice, file_hash="f1", rating=4)
+        rating.rating = 2
+        rating.save()
+
+        self.assertStats("f1", 2, 1, 2.0, [0, 1, 0, 0, 0])
+
+    def test_delete(self):
+        Rating.objects.create(user=self.alice, file_hash="f1", rating=5)
+        rating = Rating.objects.create(user=self.bob, file_hash="f1", rating=2)
+
+        rating.delete()
+        self.assertStats("f1", 5, 1, 5.0, [0, 0, 0, 0, 1])
+
+        Rating.objects.get(user=self.alice, file_hash="f1").delete()
+        self.assertStats("f1", 0, 0, 0.0, [0, 0, 0, 0, 0])
+
+    def test_changes_of_a_file_are_summed(self):
+        apply_rating_changes([("f1", None, 3), ("f1", 3, 5), ("f2", None, 1)])
+
+        self.assertStats("f1", 5, 1, 5.0, [0, 0, 0, 0, 1])
+        self.assertStats("f2", 1, 1, 1.0, [1, 0, 0, 0, 0])
+
+    def test_changes_that_cancel_out_write_nothing(self):
+        apply_rating_changes([("f1", None, 3), ("f1", 3, None)])
+
+        self.assertFalse(FileRatingStats.objects.filter(file_hash="f1").exists())
+
+    def test_upsert_inserts_new_ratings(self):
+        stored, created = upsert_ratings(self.alice, {"f1": 5, "f2": 3})
+
+        self.assertEqual([(rating.file_hash, rating.rating) for rating in stored], [("f1", 5), ("f2", 3)])
+        self.assertEqual(created, {"f1", "f2"})
+        self.assertStats("f1", 5, 1, 5.0, [0, 0, 0, 0, 1])
+        self.assertStats("f2", 3, 1, 3.0, [0, 0, 1, 0, 0])
+
+    def test_upsert_rerates(self):
+        Rating.objects.create(user=self.bob, file_hash="f1", rating=4)
+        upsert_ratings(self.alice, {"f1": 5})
+        created_at = Rating.objects.get(user=self.alice, file_hash="f1").created_at
+
+        stored, created = upsert_ratings(self.alice, {"f1": 1, "f2": 2})
+
+        self.assertEqual(created, {"f2"})
+        self.assertEqual(stored[0].created_at, created_at)
+        self.assertEqual(Rating.objects.get(user=self.alice, file_hash="f1").rating, 1)
+        self.assertEqual(Rating.objects.filter(user=self.alice).count(), 2)
+        self.assertStats("f1", 5, 2, 2.5, [1, 0, 0, 1, 0])
+        self.assertStats("f2", 2, 1, 2.0, [0, 1, 0, 0, 0])
+
+    def test_upsert_with_the_same_rating_keeps_the_stats(self):
+        upsert_ratings(self.alice, {"f1": 3})
+        upsert_ratings(self.alice, {"f1": 3})
+
+        self.assertStats("f1", 3, 1, 3.0, [0, 0, 1, 0, 0])
+
+
+class FileSimilarityTests(SimpleTestCase):
+    # as rating vectors over (u1, u2, u3): a = b = (5, 4, 0), c = (1, 0, 5), d = (0, 0, 5)
+    RATINGS = [
+        ("u1", "a", 5), ("u1", "b", 5), ("u1", "c", 1),
+        ("u2", "a", 4), ("u2", "b", 4),
+        ("u3", "c", 5), ("u3", "d", 5),
+    ]
+
+    def test_no_ratings(self):
+        self.assertEqual(compute_file_similarities([]), {})
+
+    def test_cosine_similarity_most_similar_first(self):
+        similarities = compute_file_similarities(self.RATINGS)
+
+        self.assertEqual([file_hash for file_hash, _ in similarities["a"]], ["b", "c"])
+        self.assertAlmostEqual(similarities["a"][0][1], 1.0)
+        self.assertAlmostEqual(similarities["a"][1][1], 5 / (41 ** 0.5 * 26 ** 0.5))
+        self.assertEqual([file_hash for file_hash, _ in similarities["d"]], ["c"])
+        self.assertAlmostEqual(similarities["d"][0][1], 25 / (26 ** 0.5 * 5))
+
+    def test_files_without_common_raters_or_themselves_are_left_out(self):
+        similarities = compute_file_similarities(self.RATINGS)
+
+        for file_hash, similar in similarities.items():
+            similar_hashes = [similar_hash for similar_hash, _ in similar]
+            self.assertNotIn(file_hash, similar_hashes)
+        self.assertNotIn("d", [file_hash for file_hash, _ in similarities["a"]])
+
+    def test_only_the_nearest_neighbours_are_kept(self):
+        similarities = compute_file_similarities(self.RATINGS, neighbours=1)
+
+        self.assertEqual([file_hash for file_hash, _ in similarities["c"]], ["d"])
+        self.assertTrue(all(len(similar) <= 1 for similar in similarities.values()))
+
+
+class PlanReplicationTests(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f"user{i}", email=f"user{i}@example.com", password="pass", free_space=1000)
+            for i in range(3)
+        ]
+        self.user_ids = [user.id for user in self.users]
+
+    def shared_file(self, file_hash, file_size=100, deficit=1):
+        Shared.objects.create(file_hash=file_hash, file_name=file_hash, magnetLink=f"magnet:{file_hash}", file_size=file_size)
+        return {"file_hash": file_hash, "magnetLink": f"magnet:{file_hash}", "file_size": file_size, "deficit": deficit}
+
+    def set_free_space(self, *free_spaces):
+        for user, free_space in zip(self.users, free_spaces):
+            User.objects.filter(id=user.id).update(free_space=free_space)
+
+    def planned(self, plan):
+        return [(self.user_ids.index(user_id), file["file_hash"]) for user_id, file in plan]
+
+    def test_no_files_or_users(self):
+        self.assertEqual(plan_replication([], self.user_ids), [])
+        self.assertEqual(plan_replication([self.shared_file("f1")], []), [])
+
+    def test_holders_are_skipped(self):
+        file = self.shared_file("f1", deficit=3)
+        Shared.objects.get(file_hash="f1").currently_sharing_users.add(self.users[0])
+        BackupAssignment.objects.create(user=self.users[1], shared_id="f1")
+
+        self.assertEqual(self.planned(plan_replication([file], self.user_ids)), [(2, "f1")])
+
+    def test_users_without_enough_free_space_are_skipped(self):
+        self.set_free_space(50, None, 2000)
+        file = self.shared_file("f1", file_size=100, deficit=3)
+
+        # an unknown free space is not a reason to skip a user, but the most free space comes first
+        self.assertEqual(self.planned(plan_replication([file], self.user_ids)), [(2, "f1"), (1, "f1")])
+
+    def test_least_loaded_users_first(self):
+        self.set_free_space(5000, 1000, 2000)
+        Shared.objects.create(file_hash="other", file_name="other", magnetLink="magnet:other")
+        Shared.objects.get(file_hash="other").currently_sharing_users.add(self.users[0])
+        file = self.shared_file("f1", deficit=2)
+
+        self.assertEqual(self.planned(plan_replication([file], self.user_ids)), [(2, "f1"), (1, "f1")])
+
+    def test_assignments_of_the_cycle_count(self):
+        self.set_free_space(150, 120, 0)
+        files = [self.shared_file("f1"), self.shared_file("f2"), self.shared_file("f3")]
+
+        # the free space taken by the files planned earlier in the cycle leaves user0 room for one file, user2 has none
+        self.assertEqual(self.planned(plan_replication(files, self.user_ids)), [(0, "f1"), (1, "f2")])
+
+    def test_at_most_max_per_user_files(self):
+        files = [self.shared_file(f"f{i}", file_size=1, deficit=3) for i in range(4)]
+
+        plan = plan_replication(files, self.user_ids, max_per_user=2)
+
+        self.assertEqual(len(plan), 6)
+        for user_id in self.user_ids:
+            self.assertEqual(sum(1 for planned_user_id, _ in plan if planned_user_id == user_id), 2)
+
+
+class MessageCursorTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", email="alice@example.com", password="pass")
+        self.group = Group.objects.create(name="group", description="group")
+        start = timezone.now() - timedelta(hours=1)
+        # two messages share a timestamp, the id orders them
+        self.messages = [
+            Message.objects.create(group=self.group, sender=self.user, content=str(i), timestamp=start + timedelta(seconds=i // 2 * 2))
+            for i in range(5)
+        ]
+        self.messages.sort(key=lambda message: (message.timestamp, message.id))
+
+    def contents(self, messages):
+        return [message.content for message in messages]
+
+    def test_round_trip(self):
+        message = self.messages[0]
+
+        self.assertEqual(decode_message_cursor(message_cursor(message)), (message.timestamp, message.id))
+
+    def test_malformed_cursors(self):
+        for cursor in [
+            "not a cursor",
+            encode_cursor({"timestamp": "2024-01-01T00:00:00+00:00"}),
+            encode_cursor(["2024-01-01T00:00:00+00:00"]),
+            encode_cursor(["yesterday", str(uuid.uuid4())]),
+            encode_cursor(["2024-01-01T00:00:00+00:00", "not a uuid"]),
+            encode_cursor(["2024-01-01T00:00:00+00:00", 1]),
+        ]:
+            with self.assertRaises(ValueError):
+                decode_message_cursor(cursor)
+
+    def test_pages_backwards(self):
+        page, has_older = message_page(self.group.id, 2)
+        self.assertEqual(self.contents(page), self.contents(self.messages[3:]))
+        self.assertTrue(has_older)
+
+        page, has_older = message_page(self.group.id, 2, before=message_cursor(page[0]))
+        self.assertEqual(self.contents(page), self.contents(self.messages[1:3]))
+        self.assertTrue(has_older)
+
+        page, has_older = message_page(self.group.id, 2, before=message_cursor(page[0]))
+        self.assertEqual(self.contents(page), self.contents(self.messages[:1]))
+        self.assertFalse(has_older)
+
+    def test_pages_forwards(self):
+        page, _ = message_page(self.group.id, 2, after=message_cursor(self.messages[0]))
+        self.assertEqual(self.contents(page), self.contents(self.messages[1:3]))
+
+        page, _ = message_page(self.group.id, 2, after=message_cursor(page[-1]))
+        self.assertEqual(self.contents(page), self.contents(self.messages[3:]))
+
+    def test_next_cursor_stops_before_the_latest_messages(self):
+        self.assertEqual(message_next_cursor(self.messages[-1]), message_cursor(self.messages[-1]))
+
+        latest = Message.objects.create(group=self.group, sender=self.user, content="latest")
+        cursor = message_next_cursor(latest)
+
+        # a message stored late, but received before the latest one, is on the next page
+        Message.objects.create(group=self.group, sender=self.user, content="late", timestamp=latest.timestamp - timedelta(seconds=1))
+        page, _ = message_page(self.group.id, 10, after=cursor)
+        self.assertEqual(self.contents(page), ["late", "latest"])
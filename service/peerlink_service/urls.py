@@ -19,6 +19,8 @@ from .views import (
     AccessViewSet,
     SearchView,
     IndexMetadataView,
+    IndexMetadataBulkView,
+    IndexMetadataStatusView,
     SendMagnetView,
     RegisterView,
     UserMeView,
@@ -26,6 +28,7 @@ from .views import (
     SharedJoinView,
     SharedLeaveView,
     SearchSuggestionsView,
+    SearchCacheStatsView,
     SharersCountView,
     ChangePasswordView,
     CommentsView,
@@ -85,11 +88,14 @@ urlpatterns = [
     # Custom views
     path('search/', SearchView.as_view(), name='search'),
     path('index-metadata/', IndexMetadataView.as_view(), name='index-metadata'),
+    path('index-metadata/bulk/', IndexMetadataBulkView.as_view(), name='index-metadata-bulk'),
+    path('index-metadata/status/', IndexMetadataStatusView.as_view(), name='index-metadata-status'),
     path('magnet/', SendMagnetView.as_view(), name='send_magnet'),
     path('virus-scan/', VirusScanView.as_view(), name='virus-scan'),
     path('shared-join/', SharedJoinView.as_view(), name='shared-join'),
     path('shared-leave/', SharedLeaveView.as_view(), name='shared-leave'),
     path('search/suggestions/', SearchSuggestionsView.as_view(), name='search-suggestions'),
+    path('search/cache-stats/', SearchCacheStatsView.as_view(), name='search-cache-stats'),
     path('sharers-count/', SharersCountView.as_view(), name='sharers-count'),
     path('comments/', CommentsView.as_view(), name='comments'),
     path('users-files/', UsersFilesView.as_view(), name='users-files'),
@@ -1,3 +1,7 @@
+import base64
+import binascii
+import json
+
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 
@@ -13,3 +17,20 @@ def send_message_to_user(user_id, message):
             "message": message,
         },
     )
+
+
+def encode_cursor(values):
+    """turns a list of JSON serializable values (e.g. Elasticsearch sort values) into an opaque pagination cursor"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """reverses `encode_cursor`, raises ValueError for a malformed cursor"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
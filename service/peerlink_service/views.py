@@ -1,4 +1,7 @@
 from datetime import timezone
+import asyncio
+from datetime import timedelta
+from asgiref.sync import sync_to_async
 
 import os
 import uuid
@@ -7,9 +10,10 @@ from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.parsers import JSONParser
 from django.shortcuts import get_object_or_404, render
 from django.http import JsonResponse
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 import hashlib
@@ -23,17 +27,25 @@ from django.contrib import messages
 from django.db.models import Q
 
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
-from .models import Access, FeedBack, User, Group, Membership, Shared, Comment, Rating, Message, Report
+from .models import Access, FeedBack, FileRatingStats, User, Group, Membership, Shared, Comment, Rating, Message, Report
 from .serializers import AccessSerializer, FeedBackSerializer, UserSerializer, GroupSerializer, MembershipSerializer, RatingSerializer, MessageSerializer, ReportSerializer
-from .search import index_file, search_file, update_file
-from .utils import send_message_to_user
+from .search import SEARCH_PAGE_SORT, acached_search_file, acached_search_file_page, acached_suggest_field_values, aget_files_by_hashes, asearch_file, suggestion_field_error, update_file
+from .search_cache import search_result_cache
+from .constants import CHAT_HISTORY_MAX_PAGE_SIZE, CHAT_HISTORY_PAGE_SIZE, CHAT_HISTORY_SETTLE_SECONDS, RATING_BATCH_MAX_SIZE, RATING_SUMMARY_MAX_FILES, SEARCH_DEFAULT_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE, SEARCH_SUGGESTIONS_SIZE
+from .indexing import enqueue_metadata, index_documents, outbox_status, validate_metadata
+from .parsers import NDJSONParser
+from .recommendations import similar_files
+from .presence import is_online, online_user_ids
+from .rating_stats import aget_rating_summaries, get_file_rating_stats, get_rating_summaries, rating_summary, upsert_ratings
+from .access_index import aattach_group_names, aget_allowed_file_hashes, aget_group_names, aget_user_group_ids, aresolve_group_ids, is_member, revoke_file_access
+from .async_views import AsyncAPIView
+from .utils import send_message_to_user, encode_cursor, decode_cursor
 
 from django.core.cache import cache
 
 from django.db import utils as django_db_utils
-from django.db.models import Avg, Count
-from collections import Counter
 
 
 # pk = Primary Key
@@ -92,18 +104,17 @@ class UserViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], url_path='online')
     def online_users(self, request):
         """
-        Returns a list of online users' IDs by checking which users are currently sharing files.
-        A user is considered online if they are actively sharing at least one file.
+        Returns a list of online users' IDs, the users connected to the websocket of any server process (see presence.py).
+        With ?user_id=<id>, returns {"online": true/false} for that user only.
         """
-        from django.db.models import Prefetch
-        
-        # Get distinct users who are currently sharing files from the Shared model
-        online_user_ids = Shared.objects.values_list('currently_sharing_users', flat=True).distinct()
-        
-        # Filter out None values
-        online_user_ids = [str(uid) for uid in online_user_ids if uid is not None]
-        
-        return Response(online_user_ids, status=status.HTTP_200_OK)
+        user_id = request.query_params.get('user_id')
+        if user_id:
+            try:
+                return Response({'online': is_online(uuid.UUID(user_id))}, status=status.HTTP_200_OK)
+            except ValueError:
+                return Response({'detail': 'Invalid user_id.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response([str(uid) for uid in online_user_ids()], status=status.HTTP_200_OK)
 
     # GET /users/myProfile/
     @action(detail = False, methods = ['get'], url_path = 'myProfile')
@@ -205,6 +216,23 @@ class UserViewSet(viewsets.ModelViewSet):
 
             return Response({'detail': f'{e}'}, status=status.HTTP_404_NOT_FOUND)
 
+    # PUT /users/updateFreeSpace
+    @action(detail = False, methods = ['put'], url_path = 'updateFreeSpace')
+    def update_free_space(self, request):
+        """The client reports how many bytes it can give to backups"""
+        try:
+            free_space = request.data.get('free_space')
+            if isinstance(free_space, bool) or not isinstance(free_space, int) or free_space < 0:
+                return Response({'detail': 'free_space must be a non negative number of bytes.'}, status=status.HTTP_400_BAD_REQUEST)
+
+            User.objects.filter(id=request.user.id).update(free_space=free_space)
+
+            return Response({'detail': 'User free space changed successfully.'}, status=status.HTTP_204_NO_CONTENT)
+
+        except Exception as e:
+
+            return Response({'detail': f'{e}'}, status=status.HTTP_404_NOT_FOUND)
+
     # PUT /users/updatePhoto
     @action(detail = False, methods = ['put'], url_path = 'updatePhoto')
     def update_photo(self, request):
@@ -452,7 +480,39 @@ class MembershipViewSet(mixins.CreateModelMixin,
             return Response({'detail': f'{e}'}, status=status.HTTP_404_NOT_FOUND)
 
 
-class SearchView(APIView):
+def search_filters(params):
+    """reads the filters of a search (see search._filter_clauses) from its query parameters, raises ValueError if one is invalid"""
+    filters = {}
+
+    for name in ("size_min", "size_max"):
+        if params.get(name):
+            try:
+                filters[name] = int(params[name])
+            except ValueError:
+                raise ValueError(f"{name} must be an integer.")
+
+    for name, param in (("timestamp_from", "from"), ("timestamp_to", "to")):
+        if params.get(param):
+            try:
+                valid = parse_datetime(params[param]) or parse_date(params[param])
+            except ValueError:
+                valid = None
+            if valid is None:
+                raise ValueError(f"{param} must be an ISO 8601 date.")
+            # passed as is, Elasticsearch fills the missing parts of a date up to the end of the day for `to`
+            filters[name] = params[param]
+
+    owner_ids = [owner_id for owner_id in params.getlist("owner") if owner_id]
+    if owner_ids:
+        filters["owner_ids"] = owner_ids
+    extensions = [extension for extension in params.getlist("extension") if extension]
+    if extensions:
+        filters["extensions"] = extensions
+
+    return filters
+
+
+class SearchView(AsyncAPIView):
 
     # You can comment it if you want to access it via API
     # Otherwise, you need to provide some valid credentials!
@@ -465,55 +525,134 @@ class SearchView(APIView):
                 description="Search term",
                 type=openapi.TYPE_STRING,
                 required=True
-            )
+            ),
+            openapi.Parameter(
+                'page_size', openapi.IN_QUERY,
+                description=f"Number of files per page (at most {SEARCH_MAX_PAGE_SIZE}). "
+                            "When `page_size` or `cursor` is given the response is a page, otherwise a list of every match",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+            openapi.Parameter(
+                'cursor', openapi.IN_QUERY,
+                description="`next_cursor` of the previous page",
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            openapi.Parameter(
+                'filter', openapi.IN_QUERY,
+                description="Metadata field to search in, or a comma separated list of fields (a file matches if any of them does)",
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            openapi.Parameter('size_min', openapi.IN_QUERY, description="Minimum size in bytes", type=openapi.TYPE_INTEGER, required=False),
+            openapi.Parameter('size_max', openapi.IN_QUERY, description="Maximum size in bytes", type=openapi.TYPE_INTEGER, required=False),
+            openapi.Parameter('from', openapi.IN_QUERY, description="Uploaded at or after (ISO 8601)", type=openapi.TYPE_STRING, required=False),
+            openapi.Parameter('to', openapi.IN_QUERY, description="Uploaded at or before (ISO 8601)", type=openapi.TYPE_STRING, required=False),
+            openapi.Parameter('owner', openapi.IN_QUERY, description="Owner id, can be repeated", type=openapi.TYPE_STRING, required=False),
+            openapi.Parameter('extension', openapi.IN_QUERY, description="File extension, can be repeated", type=openapi.TYPE_STRING, required=False),
+            openapi.Parameter(
+                'facets', openapi.IN_QUERY,
+                description="When true, the page also has `facets`: counts of the matches by group, extension and owner",
+                type=openapi.TYPE_BOOLEAN,
+                required=False
+            ),
+            openapi.Parameter(
+                'ratings', openapi.IN_QUERY,
+                description="When true, every file has `rating`: its average, count and the requester's own rating",
+                type=openapi.TYPE_BOOLEAN,
+                required=False
+            ),
         ]
     )
-    def get(self, request):
+    async def get(self, request):
         try:
             user = request.user
-            search_term = request.query_params.get("query", "")
-            group_id = request.query_params.get("group", "")
-            search_by_metadata = request.query_params.get("filter", "filename")
-
-            print("HERE", search_by_metadata)
+            search_term = request.GET.get("query", "")
+            group_id = request.GET.get("group", "")
+            search_by_metadata = request.GET.get("filter", "filename")
+            page_size = request.GET.get("page_size")
+            cursor = request.GET.get("cursor")
+            facets = request.GET.get("facets", "").lower() in ("1", "true")
+            ratings = request.GET.get("ratings", "").lower() in ("1", "true")
 
             # You cannot search via api since you need to log in
 
-            user_groups = [Group.objects.get(id=uuid.UUID(group_id))] if group_id != "" else user.groups.all()
+            group_ids = await aresolve_group_ids(user, group_id)
 
-            allowed_file_hashes = Access.objects.filter(group__in=user_groups).values_list("file_hash", flat=True)
+            try:
+                filters = search_filters(request.GET)
+            except ValueError as e:
+                return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            if page_size is None and cursor is None and not facets:
+                # the names of the searched groups are fetched while Elasticsearch runs the query
+                files, group_names = await asyncio.gather(
+                    acached_search_file(search_term, group_ids, search_by_metadata, filters),
+                    aget_group_names(group_ids),
+                )
+                return JsonResponse(await self._file_details(request, files, group_names, ratings), safe=False)
 
-            # If you want to search via web interface localhost,
-            # Comment out above and use below
+            try:
+                page_size = min(int(page_size or SEARCH_DEFAULT_PAGE_SIZE), SEARCH_MAX_PAGE_SIZE)
+                search_after = decode_cursor(cursor) if cursor else None
+                # e.g. a cursor from before the sort got another tiebreaker
+                if search_after is not None and len(search_after) != len(SEARCH_PAGE_SORT):
+                    raise ValueError("Invalid cursor")
+            except ValueError as e:
+                return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            if page_size < 1:
+                return JsonResponse({"error": "page_size must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+
+            (files, next_search_after, facet_counts), group_names = await asyncio.gather(
+                acached_search_file_page(search_term, group_ids, search_by_metadata, page_size, search_after, filters, facets),
+                aget_group_names(group_ids),
+            )
 
-            # allowed_file_hashes = []
-            print(allowed_file_hashes)
-            files = search_file(search_term, allowed_file_hashes, search_by_metadata)
-            for file in files:
-                access = Access.objects.filter(file_hash=file["hash"])[0]
-                file["group"] = access.group.name
+            page = {
+                "results": await self._file_details(request, files, group_names, ratings),
+                "next_cursor": encode_cursor(next_search_after) if next_search_after else None,
+            }
+            if facets:
+                for bucket in facet_counts.get("groups", []):
+                    bucket["name"] = group_names.get(bucket["key"])
+                page["facets"] = facet_counts
 
-            print(files)
-            return Response(files)
+            return JsonResponse(page)
         except Exception as e:
             print(e)
-            return Response(
+            return JsonResponse(
                 {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-    def put(self, request):
+    async def _file_details(self, request, files, group_names, ratings):
+        """sets the group name of every file hit and, if `ratings` is set, its rating summary"""
+        if not ratings:
+            return await aattach_group_names(files, group_names)
+
+        files, summaries = await asyncio.gather(
+            aattach_group_names(files, group_names),
+            aget_rating_summaries([file["hash"] for file in files], request.user),
+        )
+        for file in files:
+            file["rating"] = summaries[file["hash"]]
+        return files
+
+    async def put(self, request):
         try:
             user = request.user
-            magnetLink = request.data['magnetLink']
-            update_fields = request.data['updateFields']
+            data = self.json_body(request)
+            magnetLink = data['magnetLink']
+            update_fields = data['updateFields']
 
-            response = update_file(magnetLink, update_fields)
-            return Response(response)
+            response = await sync_to_async(update_file)(magnetLink, update_fields)
+            return JsonResponse(response.body, safe=False)
 
         except Exception as e:
             print(e)
-            return Response(
+            return JsonResponse(
                 {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
@@ -570,7 +709,10 @@ class IndexMetadataView(APIView):
     # permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        """Index file metadata in Elasticsearch"""
+        """
+        Queue file metadata for indexing in Elasticsearch.
+        The document is indexed in the background, GET /index-metadata/status/ reports the backlog.
+        """
         try:
             metadata = {
                 **request.data,
@@ -586,11 +728,72 @@ class IndexMetadataView(APIView):
             #    Access.objects.create(group=group, file_hash=request.data.get('hash'))
             ################################################################
 
-            # Index the metadata in Elasticsearch
-            index_file(metadata)
-            
+            error = validate_metadata(metadata)
+            if error:
+                return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Index the metadata in Elasticsearch, together with the other documents that arrive meanwhile
+            task = enqueue_metadata(metadata)
+
             return Response({
-                "message": "File metadata indexed successfully"
+                "message": "File metadata queued for indexing",
+                "task_id": task.id,
+            }, status=status.HTTP_202_ACCEPTED)
+        except Exception as e:
+            print(str(e))
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class IndexMetadataStatusView(APIView):
+    # permission_classes = [IsAuthenticated]
+
+    # GET /index-metadata/status/
+    def get(self, request):
+        """Backlog of the indexing queue: pending, retrying and failed documents and the indexing lag in seconds"""
+        return Response(outbox_status())
+
+
+class IndexMetadataBulkView(APIView):
+    # permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser, NDJSONParser]
+
+    # POST /index-metadata/bulk/
+    def post(self, request):
+        """
+        Index many file metadata documents in Elasticsearch with one bulk request.
+        Accepts a JSON list or NDJSON (application/x-ndjson), one document per line.
+        Returns the result of every document in the order they were sent.
+        """
+        documents = request.data
+        if not isinstance(documents, list):
+            return Response({"error": "A list of metadata documents is expected."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            items = [None] * len(documents)
+            valid = []
+            for idx, document in enumerate(documents):
+                error = validate_metadata(document)
+                if error:
+                    magnetLink = document.get("magnetLink") if isinstance(document, dict) else None
+                    items[idx] = {"magnetLink": magnetLink, "status": status.HTTP_400_BAD_REQUEST, "error": error}
+                else:
+                    valid.append((idx, {
+                        **document,
+                        'owner_id': str(request.user.id),
+                        'owner_username': request.user.username,
+                    }))
+
+            if valid:
+                results = index_documents([metadata for _, metadata in valid])
+                for (idx, _), result in zip(valid, results):
+                    items[idx] = result
+
+            return Response({
+                "errors": sum(1 for item in items if "error" in item),
+                "items": items,
             })
         except Exception as e:
             print(str(e))
@@ -881,8 +1084,16 @@ class SharedJoinView(APIView):
             except Exception as e:
                 return Response({ 'error': str(e) }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        # the backup job only sends the file to users who reported enough free space for it
+        file_size = request.data.get('size')
+        if isinstance(file_size, bool) or not isinstance(file_size, int):
+            file_size = None
+
         try:
-            shared = Shared.objects.get_or_create(file_hash=hash, file_name=file_name, magnetLink=magnetLink)[0]
+            shared = Shared.objects.get_or_create(file_hash=hash, file_name=file_name, magnetLink=magnetLink, defaults={'file_size': file_size})[0]
+            if shared.file_size is None and file_size is not None:
+                shared.file_size = file_size
+                shared.save(update_fields=['file_size'])
             shared.currently_sharing_users.add(user)
             return Response({ 'detail': 'User added to pool of file sharers.' }, status=status.HTTP_200_OK)
 
@@ -905,36 +1116,33 @@ class SharedLeaveView(APIView):
             return Response({ 'error': str(e) }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class SearchSuggestionsView(APIView):
-    def get(self, request):
-        user = request.user
-        search_term = request.query_params.get("query", "")
-        group_id = request.query_params.get("group", "")
-        search_by_metadata = request.query_params.get("filter", "filename")
-
-        # You cannot search via api since you need to log in
-        print(search_by_metadata)
+class SearchCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
 
-        user_groups = [Group.objects.get(id=uuid.UUID(group_id))] if group_id != "" else user.groups.all()
+    # GET /search/cache-stats/
+    def get(self, request):
+        """Hit, miss and eviction counters of this process' search result cache"""
+        return Response(search_result_cache.stats())
 
-        allowed_file_hashes = Access.objects.filter(group__in=user_groups).values_list("file_hash", flat=True)
 
-        # If you want to search via web interface localhost,
-        # Comment out above and use below
+class SearchSuggestionsView(AsyncAPIView):
+    async def get(self, request):
+        user = request.user
+        search_term = request.GET.get("query", "")
+        group_id = request.GET.get("group", "")
+        search_by_metadata = request.GET.get("filter", "filename")
 
-        # allowed_file_hashes = []
+        error = suggestion_field_error(search_by_metadata)
+        if error:
+            return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
 
-        response = search_file(search_term, allowed_file_hashes, search_by_metadata)
+        # You cannot search via api since you need to log in
 
-        suggestions = set()
+        group_ids = await aresolve_group_ids(user, group_id)
 
-        for res in response:
-            if len(suggestions) == 5:
-                break
-            if search_by_metadata in res:
-                suggestions.add(res[search_by_metadata])
+        suggestions = await acached_suggest_field_values(search_term, group_ids, search_by_metadata, SEARCH_SUGGESTIONS_SIZE)
 
-        return Response(list(suggestions))
+        return JsonResponse(suggestions, safe=False)
 
 
 class SharersCountView(APIView):
@@ -986,23 +1194,33 @@ class CommentsView(APIView):
             return Response({ 'error': str(e) }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class UsersFilesView(APIView):
-    def get(self, request):
+class UsersFilesView(AsyncAPIView):
+    async def get(self, request):
         try:
             user = request.user
-            allowed_file_hashes = Access.objects.filter(group__in=user.groups.all()).values_list("file_hash", flat=True)
+            group_ids = await aget_user_group_ids(user)
 
-            files = search_file(str(user.id), allowed_file_hashes, "owner_id")
-            for file in files:
-                access = Access.objects.filter(file_hash=file["hash"])[0]
-                file["group"] = access.group.name
+            files, group_names = await asyncio.gather(
+                asearch_file(str(user.id), group_ids, "owner_id"),
+                aget_group_names(group_ids),
+            )
 
-            print("in UsersFilesView:", files)
-            return Response(files)
+            return JsonResponse(await aattach_group_names(files, group_names), safe=False)
 
         except Exception as e:
             print(e)
-            return Response([])
+            return JsonResponse([], safe=False)
+
+
+def validate_rating(file_hash, rating_value):
+    """returns why a rating of `file_hash` cannot be stored, or None if it can"""
+    if not isinstance(file_hash, str) or not file_hash:
+        return 'File hash is required.'
+    if len(file_hash) > Rating._meta.get_field('file_hash').max_length:
+        return 'File hash is too long.'
+    if isinstance(rating_value, bool) or str(rating_value) not in ('1', '2', '3', '4', '5'):
+        return 'Rating must be an integer from 1 to 5.'
+    return None
 
 
 class RatingViewSet(viewsets.ModelViewSet):
@@ -1019,26 +1237,26 @@ class RatingViewSet(viewsets.ModelViewSet):
             # Validate input
             if not file_hash or not rating_value:
                 return Response({'detail': 'File hash and rating are required.'}, status=status.HTTP_400_BAD_REQUEST)
+            error = validate_rating(file_hash, rating_value)
+            if error:
+                return Response({'detail': error}, status=status.HTTP_400_BAD_REQUEST)
             
-            # Try to find existing rating from this user for this file
-            try:
-                rating = Rating.objects.get(user=request.user, file_hash=file_hash)
-                rating.rating = rating_value
-                rating.save()
-                serializer = self.get_serializer(rating)
-                return Response(serializer.data)
-            except Rating.DoesNotExist:
-                # Create new rating
-                rating = Rating.objects.create(
-                    user=request.user,
-                    file_hash=file_hash,
-                    rating=rating_value
-                )
-                serializer = self.get_serializer(rating)
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
+            # Create the rating, or update it if the user already rated this file, in one statement
+            # together with the stats of the file
+            (rating,), created = upsert_ratings(request.user, {file_hash: int(rating_value)})
+            serializer = self.get_serializer(rating)
+            return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
         except Exception as e:
             return Response({'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+
     # GET /ratings/file/{file_hash}/
     @action(detail=False, methods=['get'], url_path='file/(?P<file_hash>[^/.]+)')
     def get_file_ratings(self, request, file_hash=None):
@@ -1053,13 +1271,83 @@ class RatingViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], url_path='average/(?P<file_hash>[^/.]+)')
     def get_average_rating(self, request, file_hash=None):
         try:
-            result = Rating.objects.filter(file_hash=file_hash).aggregate(
-                average=Avg('rating'),
-                count=Count('rating')
-            )
+            stats = FileRatingStats.objects.filter(file_hash=file_hash).first()
+            return Response({
+                'average': round(stats.average, 1) if stats and stats.rating_count else 0,
+                'count': stats.rating_count if stats else 0
+            })
+        except Exception as e:
+            return Response({'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # GET /ratings/stats/?file_hash=...&file_hash=...
+    @action(detail=False, methods=['get'], url_path='stats')
+    def get_stats(self, request):
+        """Average, count and histogram of the ratings of many files at once, by file hash"""
+        try:
+            file_hashes = request.query_params.getlist('file_hash')
+            if not file_hashes:
+                return Response({'detail': 'At least one file_hash is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+            stats = get_file_rating_stats(file_hashes)
+            return Response({file_hash: rating_summary(stats.get(file_hash)) for file_hash in file_hashes})
+        except Exception as e:
+            return Response({'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # POST /ratings/summary/
+    @action(detail=False, methods=['post'], url_path='summary')
+    def get_summary(self, request):
+        """Average, count and the caller's own rating of many files at once, e.g. of a page of search results"""
+        try:
+            file_hashes = request.data.get('file_hashes')
+            if not isinstance(file_hashes, list) or not all(isinstance(file_hash, str) for file_hash in file_hashes):
+                return Response({'detail': 'file_hashes must be a list of file hashes.'}, status=status.HTTP_400_BAD_REQUEST)
+            if len(file_hashes) > RATING_SUMMARY_MAX_FILES:
+                return Response({'detail': f'At most {RATING_SUMMARY_MAX_FILES} files at once.'}, status=status.HTTP_400_BAD_REQUEST)
+
+            return Response(get_rating_summaries(file_hashes, request.user))
+        except Exception as e:
+            return Response({'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # POST /ratings/batch/
+    @action(detail=False, methods=['post'], url_path='batch')
+    def create_batch(self, request):
+        """
+        Create or update many ratings of the user at once, e.g. ratings given while offline.
+        Expects {"ratings": [{"file_hash": ..., "rating": ...}, ...]}, a later rating of the same file wins.
+        Returns the result of every rating in the order they were sent.
+        """
+        ratings = request.data.get('ratings') if isinstance(request.data, dict) else None
+        if not isinstance(ratings, list):
+            return Response({'detail': 'A list of ratings is expected.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ratings) > RATING_BATCH_MAX_SIZE:
+            return Response({'detail': f'At most {RATING_BATCH_MAX_SIZE} ratings at once.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            items = [None] * len(ratings)
+            valid = {}
+            for idx, item in enumerate(ratings):
+                file_hash = item.get('file_hash') if isinstance(item, dict) else None
+                error = validate_rating(file_hash, item.get('rating')) if isinstance(item, dict) else 'A rating must be an object.'
+                if error:
+                    items[idx] = {'file_hash': file_hash, 'status': status.HTTP_400_BAD_REQUEST, 'error': error}
+                else:
+                    valid[file_hash] = int(item['rating'])
+                    items[idx] = file_hash
+
+            if valid:
+                stored, created = upsert_ratings(request.user, valid)
+                stored = {rating.file_hash: self.get_serializer(rating).data for rating in stored}
+                for idx, item in enumerate(items):
+                    if isinstance(item, str):
+                        items[idx] = {
+                            'file_hash': item,
+                            'status': status.HTTP_201_CREATED if item in created else status.HTTP_200_OK,
+                            'rating': stored[item],
+                        }
+
             return Response({
-                'average': round(result['average'], 1) if result['average'] else 0,
-                'count': result['count']
+                'errors': sum(1 for item in items if 'error' in item),
+                'items': items,
             })
         except Exception as e:
             return Response({'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -1075,130 +1363,75 @@ class RatingViewSet(viewsets.ModelViewSet):
             return Response({'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class RecommendationView(APIView):
-    permission_classes = [IsAuthenticated]
+class RecommendationView(AsyncAPIView):
+    authentication_required = True
 
-    def get(self, request):
+    async def get(self, request):
         try:
             # Fetch user's ratings
             user_ratings = Rating.objects.filter(user=request.user)
+            user_file_hashes = [file_hash async for file_hash in user_ratings.values_list('file_hash', flat=True)]
+            liked_file_hashes = [file_hash async for file_hash in user_ratings.filter(rating__gte=4).values_list('file_hash', flat=True)]  # Only consider 4 or 5 star ratings
             
-            # If user has no ratings, return popular files
-            if not user_ratings.exists():
-                return self._get_popular_files(request)
-            
-            # Get users with similar tastes
-            user_file_hashes = user_ratings.values_list('file_hash', flat=True)
-            
-            # Find other users who rated the same files
-            similar_users = Rating.objects.filter(
-                file_hash__in=user_file_hashes
-            ).exclude(
-                user=request.user
-            ).values_list('user', flat=True).distinct()
-            
-            # Get files rated highly by similar users that the current user hasn't rated
-            recommended_files = Rating.objects.filter(
-                user__in=similar_users,
-                rating__gte=4  # Only consider 4 or 5 star ratings
-            ).exclude(
-                file_hash__in=user_file_hashes
-            ).values_list('file_hash', flat=True)
-            
-            # Count occurrences of each file_hash
-            file_counts = Counter(recommended_files)
+            # If user has no liked files, return popular files
+            if not liked_file_hashes:
+                return await self._get_popular_files(request)
             
-            # Sort by frequency
-            sorted_files = [file_hash for file_hash, _ in file_counts.most_common(20)]  # Increased to 20 to account for duplicates
+            # The files most similar to the ones the user liked, that the user hasn't rated,
+            # from the similarities precomputed by recommendations.refresh_file_similarities
+            sorted_files = [
+                file_hash async for file_hash in similar_files(liked_file_hashes, user_file_hashes, 20)  # Increased to 20 to account for duplicates
+            ]
             
-            # Get actual file data from Elasticsearch (reusing search_file function)
+            # Get actual file data from Elasticsearch
             # Access check: Only include files the user has access to
-            user_groups = request.user.groups.all()
-            allowed_file_hashes = Access.objects.filter(group__in=user_groups).values_list("file_hash", flat=True)
+            group_ids = await aget_user_group_ids(request.user)
+            allowed_file_hashes, group_names = await asyncio.gather(
+                aget_allowed_file_hashes(group_ids),
+                aget_group_names(group_ids),
+            )
             
-            # Find the intersection of recommended files and files the user has access to
-            accessible_recommendations = set(sorted_files).intersection(set(allowed_file_hashes))
+            # Find the recommended files the user has access to, most similar first
+            accessible_recommendations = [file_hash for file_hash in sorted_files if file_hash in allowed_file_hashes]
             
             if not accessible_recommendations:
-                return self._get_popular_files(request)
+                return await self._get_popular_files(request)
                 
-            # Get full file details
-            result = []
-            for file_hash in accessible_recommendations:
-                # Try to find file in Shared model
-                try:
-                    shared_file = Shared.objects.get(file_hash=file_hash)
-                    # Get additional details from Elasticsearch
-                    es_results = search_file_by_hash(file_hash, list(allowed_file_hashes))
-                    if es_results:
-                        result.extend(es_results)
-                except Shared.DoesNotExist:
-                    # If not in Shared, just use Elasticsearch
-                    es_results = search_file_by_hash(file_hash, list(allowed_file_hashes))
-                    if es_results:
-                        result.extend(es_results)
-            
-            # Filter out duplicates by hash
-            unique_results = {}
-            for file_data in result:
-                file_hash = file_data.get('hash')
-                if file_hash and (file_hash not in unique_results or 'id' in file_data):
-                    access = Access.objects.filter(file_hash=file_hash)[0]
-                    file_data["group"] = access.group.name
-                    unique_results[file_hash] = file_data
-
-            return Response(list(unique_results.values())[:10])  # Limit to 10 recommendations
+            # Get full file details, one document per file with a single Elasticsearch request
+            result = await aget_files_by_hashes(accessible_recommendations, group_ids)
+
+            files = await aattach_group_names(result[:10], group_names)  # Limit to 10 recommendations
+            return JsonResponse(files, safe=False)
             
         except Exception as e:
-            return Response(
+            return JsonResponse(
                 {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
             
-    def _get_popular_files(self, request):
+    async def _get_popular_files(self, request):
         # Get top-rated files overall
-        top_rated_files = Rating.objects.values('file_hash').annotate(
-            avg_rating=Avg('rating'),
-            num_ratings=Count('rating')
-        ).filter(
-            avg_rating__gte=4,  # At least 4 stars
-            num_ratings__gte=1  # At least 1 rating
-        ).order_by('-avg_rating', '-num_ratings')[:20]  # Increased to 20 to account for duplicates
+        top_rated_files = FileRatingStats.objects.filter(
+            average__gte=4,  # At least 4 stars
+            rating_count__gte=1  # At least 1 rating
+        ).order_by('-average', '-rating_count')[:20]  # Increased to 20 to account for duplicates
         
         # Extract the file hashes
-        file_hashes = [item['file_hash'] for item in top_rated_files]
+        file_hashes = [file_hash async for file_hash in top_rated_files.values_list('file_hash', flat=True)]
         
         # Only include files the user has access to
-        user_groups = request.user.groups.all()
-        allowed_file_hashes = Access.objects.filter(group__in=user_groups).values_list("file_hash", flat=True)
-        accessible_files = set(file_hashes).intersection(set(allowed_file_hashes))
+        group_ids = await aget_user_group_ids(request.user)
+        allowed_file_hashes, group_names = await asyncio.gather(
+            aget_allowed_file_hashes(group_ids),
+            aget_group_names(group_ids),
+        )
+        accessible_files = [file_hash for file_hash in file_hashes if file_hash in allowed_file_hashes]
         
-        # Get file details
-        result = []
-        for file_hash in accessible_files:
-            es_results = search_file_by_hash(file_hash, list(allowed_file_hashes))
-            if es_results:
-                result.extend(es_results)
-
-        # Filter out duplicates by hash
-        unique_results = {}
-        for file_data in result:
-            file_hash = file_data.get('hash')
-            if file_hash and (file_hash not in unique_results or 'id' in file_data):
-                access = Access.objects.filter(file_hash=file_hash)[0]
-                file_data["group"] = access.group.name
-                unique_results[file_hash] = file_data
-
-        return Response(list(unique_results.values())[:10])  # Limit to 10 recommendations
-
-# Helper function to search by hash
-def search_file_by_hash(file_hash, allowed_file_hashes):
-    try:
-        from .search import search_file
-        return search_file(file_hash, allowed_file_hashes, "hash")
-    except Exception as e:
-        print(f"Error searching file by hash: {e}")
-        return []
+        # Get file details, one document per file with a single Elasticsearch request
+        result = await aget_files_by_hashes(accessible_files, group_ids)
+
+        files = await aattach_group_names(result[:10], group_names)  # Limit to 10 recommendations
+        return JsonResponse(files, safe=False)
 
 
 # TO DO
@@ -1256,6 +1489,59 @@ class FeedBackViewSet(viewsets.ModelViewSet):
             return Response({'detail': 'Feedbkac is not found.'}, status=status.HTTP_400_BAD_REQUEST)
 
 
+def message_cursor(message):
+    """the position of `message` in the history of its group, which is ordered by (timestamp, id)"""
+    return encode_cursor([message.timestamp.isoformat(), str(message.id)])
+
+
+def decode_message_cursor(cursor):
+    """reverses `message_cursor`, raises ValueError for a malformed cursor"""
+    values = decode_cursor(cursor)
+    timestamp = parse_datetime(values[0]) if len(values) == 2 and isinstance(values[0], str) else None
+    if timestamp is None or not isinstance(values[1], str):
+        raise ValueError("Invalid cursor")
+    return timestamp, uuid.UUID(values[1])
+
+
+def message_next_cursor(message):
+    """
+    the `next_cursor` of a page whose newest message is `message`. chat messages are stored a moment after they are
+    broadcast, so an older message may still be missing while `message` is already stored. the cursor stops before
+    the messages of the last CHAT_HISTORY_SETTLE_SECONDS, which are returned again by the next page (clients skip
+    the ones they already have by their id)
+    """
+    settled = timezone.now() - timedelta(seconds=CHAT_HISTORY_SETTLE_SECONDS)
+    if message.timestamp <= settled:
+        return message_cursor(message)
+    # right before every message received after `settled`
+    return encode_cursor([settled.isoformat(), str(uuid.UUID(int=0))])
+
+
+def message_page(group_id, page_size, before=None, after=None):
+    """
+    returns up to `page_size` messages of the group in chronological order: the ones right before the cursor `before`,
+    right after the cursor `after`, or the latest ones, and whether there are older messages than the returned ones.
+    the messages are found by a range scan of the (group, timestamp, id) index, whatever the size of the history
+    """
+    messages = Message.objects.filter(group_id=group_id).select_related('sender')
+
+    if after is not None:
+        timestamp, message_id = decode_message_cursor(after)
+        page = list(messages.filter(
+            Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id)
+        ).order_by('timestamp', 'id')[:page_size])
+        # the message of the cursor itself is older
+        return page, True
+
+    if before is not None:
+        timestamp, message_id = decode_message_cursor(before)
+        messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+
+    page = list(messages.order_by('-timestamp', '-id')[:page_size + 1])
+    has_older = len(page) > page_size
+    return page[:page_size][::-1], has_older
+
+
 class MessageViewSet(viewsets.ModelViewSet):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
@@ -1270,7 +1556,7 @@ class MessageViewSet(viewsets.ModelViewSet):
         group_id = self.request.query_params.get('group_id', None)
         if group_id is not None:
             # Check if the user is a member of the group
-            if not self.request.user.groups.filter(id=group_id).exists():
+            if not is_member(self.request.user, group_id):
                 return Message.objects.none()
             queryset = queryset.filter(group__id=group_id)
         return queryset
@@ -1285,7 +1571,7 @@ class MessageViewSet(viewsets.ModelViewSet):
         # Check if user is a member of the group
         try:
             group = Group.objects.get(id=group_id)
-            if not request.user.groups.filter(id=group_id).exists():
+            if not is_member(request.user, group_id):
                 return Response(
                     {"detail": "You are not a member of this group."},
                     status=status.HTTP_403_FORBIDDEN
@@ -1323,23 +1609,63 @@ class MessageViewSet(viewsets.ModelViewSet):
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'page_size', openapi.IN_QUERY,
+                description=f"Number of messages (default {CHAT_HISTORY_PAGE_SIZE}, at most {CHAT_HISTORY_MAX_PAGE_SIZE})",
+                type=openapi.TYPE_INTEGER,
+                required=False
+            ),
+            openapi.Parameter(
+                'before', openapi.IN_QUERY,
+                description="`previous_cursor` of a page, to get the messages before it",
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            openapi.Parameter(
+                'after', openapi.IN_QUERY,
+                description="`next_cursor` of a page, to get the messages after it (it may repeat the newest messages of that page)",
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+        ]
+    )
     @action(detail=False, methods=['get'], url_path='group/(?P<group_id>[^/.]+)')
     def group_messages(self, request, group_id=None):
         """
-        Get all messages for a specific group
+        Get a page of the messages of a group, the latest ones unless `before` or `after` is given.
+        `previous_cursor` is null when there are no older messages, `next_cursor` is the position
+        to ask for the messages sent since then from. It stops before the messages of the last few seconds,
+        which may not all be stored yet, so the next page can repeat some messages of this one.
         """
         try:
             # Check if the user is a member of the group
-            if not request.user.groups.filter(id=group_id).exists():
+            if not is_member(request.user, group_id):
                 return Response(
                     {"detail": "You are not a member of this group."},
                     status=status.HTTP_403_FORBIDDEN
                 )
-            
-            # Get the messages for this group
-            messages = Message.objects.filter(group__id=group_id).order_by('timestamp')
+
+            before = request.query_params.get('before')
+            after = request.query_params.get('after')
+            if before is not None and after is not None:
+                return Response({"detail": "Only one of before and after can be given."}, status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                page_size = min(int(request.query_params.get('page_size', CHAT_HISTORY_PAGE_SIZE)), CHAT_HISTORY_MAX_PAGE_SIZE)
+                if page_size < 1:
+                    raise ValueError("page_size must be positive.")
+                messages, has_older = message_page(group_id, page_size, before, after)
+            except ValueError as e:
+                return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
             serializer = self.get_serializer(messages, many=True)
-            return Response(serializer.data)
+            return Response({
+                "results": serializer.data,
+                "previous_cursor": message_cursor(messages[0]) if messages and has_older else None,
+                "next_cursor": message_next_cursor(messages[-1]) if messages else after,
+            })
         
         except Group.DoesNotExist:
             return Response(
@@ -1418,6 +1744,7 @@ class ReportStatusUpdateView(APIView):
 
         if new_status == 'APPROVED':
             # Delete the reported file
+            revoke_file_access(report.file.file_hash)
             report.file.delete()
 
         return Response(ReportSerializer(report).data)
@@ -1494,6 +1821,7 @@ class ReportUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         # Then handle file deletion if status changed to APPROVED
         if old_status != 'APPROVED' and new_status == 'APPROVED':
             file_to_delete = report.file
+            revoke_file_access(file_to_delete.file_hash)
             file_to_delete.delete()
             messages.success(self.request, f'Report #{report.id} approved and file deleted.')
         else: